@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Runs the blocking effects from ws2801_funcs.py without freezing the web server.
+# An effect gets a CaptureDevice instead of the real strip and runs on a worker
+# thread; each show() hands a finished frame back to the event loop, and a stop
+# request is noticed at the effect's next show().
+
+import asyncio
+import threading
+import time
+
+
+class EffectCancelled(Exception):
+    pass
+
+
+class CaptureDevice:
+    # looks enough like Adafruit_WS2801.WS2801Pixels for the effect functions
+    def __init__(self, count, on_frame, cancelled):
+        self._count = count
+        self._pixels = [0] * (count * 3)
+        self._on_frame = on_frame
+        self._cancelled = cancelled
+
+    def count(self):
+        return self._count
+
+    def set_pixel(self, n, color):
+        self.set_pixel_rgb(n, (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+    def set_pixel_rgb(self, n, r, g, b):
+        self._pixels[n * 3] = r & 0xFF
+        self._pixels[n * 3 + 1] = g & 0xFF
+        self._pixels[n * 3 + 2] = b & 0xFF
+
+    def set_pixels(self, color):
+        for n in range(self._count):
+            self.set_pixel(n, color)
+
+    def get_pixel(self, n):
+        r, g, b = self.get_pixel_rgb(n)
+        return (r << 16) | (g << 8) | b
+
+    def get_pixel_rgb(self, n):
+        return tuple(self._pixels[n * 3:n * 3 + 3])
+
+    def clear(self):
+        self._pixels[:] = [0] * len(self._pixels)
+
+    def show(self):
+        if self._cancelled.is_set():
+            raise EffectCancelled()
+        self._on_frame(bytes(self._pixels))
+
+
+class AnimationRunner:
+    # one effect at a time; starting a new one preempts the old one
+    def __init__(self, count, on_frame, on_state, progress_interval=1.0):
+        self.count = count
+        self.on_frame = on_frame    # called on the event loop with strip-order RGB bytes
+        self.on_state = on_state    # called on the event loop with the state dict below
+        self.progress_interval = progress_interval
+        self.name = None
+        self.status = "idle"        # idle, running, stopping, finished, stopped, failed
+        self.frames = 0
+        self.error = None
+        self.task = None
+        self.cancelled = None
+        self.last_progress = 0.0
+
+    def state(self):
+        state = {"Name": self.name, "State": self.status, "Frames": self.frames}
+        if self.error:
+            state["Error"] = self.error
+        return state
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def _set_status(self, status):
+        self.status = status
+        self.on_state(self.state())
+
+    async def start(self, name, effect, *args, **kwargs):
+        # effect is called as effect(device, *args, **kwargs) on a worker thread
+        await self.stop()
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+
+        def hand_off(frame): # worker thread -> event loop
+            loop.call_soon_threadsafe(self._frame_ready, cancelled, frame)
+
+        device = CaptureDevice(self.count, hand_off, cancelled)
+        self.cancelled = cancelled
+        self.name = name
+        self.frames = 0
+        self.error = None
+        self.last_progress = time.monotonic()
+        self._set_status("running")
+        self.task = asyncio.ensure_future(self._run(loop, effect, device, cancelled, args, kwargs))
+        return self.task
+
+    async def _run(self, loop, effect, device, cancelled, args, kwargs):
+        try:
+            await loop.run_in_executor(None, lambda: effect(device, *args, **kwargs))
+        except EffectCancelled:
+            self._set_status("stopped")
+        except Exception as ex:
+            self.error = str(ex)
+            self._set_status("failed")
+        else:
+            self._set_status("stopped" if cancelled.is_set() else "finished")
+
+    def _frame_ready(self, cancelled, frame):
+        if cancelled is not self.cancelled or cancelled.is_set():
+            return # late frame from an effect we've already moved on from
+        self.frames += 1
+        self.on_frame(frame)
+        now = time.monotonic()
+        if now - self.last_progress >= self.progress_interval:
+            self.last_progress = now
+            self.on_state(self.state())
+
+    def cancel(self):
+        # ask the current effect to stop without waiting; any frames it still produces are ignored
+        if not self.running or self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        self._set_status("stopping")
+
+    async def stop(self):
+        # like cancel(), but waits for the effect's thread to notice
+        if not self.running:
+            return
+        self.cancel()
+        await asyncio.wait([self.task])
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Native animation files (.wpa) for zero-copy playback.
+# A fixed header is followed by frame_count raw frames of width*height RGB triples in
+# LED strip order, so every frame is the same size.  Playback mmaps the file and hands
+# frame slices straight to framebuffer.write_strip(); seeking is just an offset.
+#
+#   magic "WPAN" | version:u8 | flags:u8 | width:u16 | height:u16 | fps:f32 | frame_count:u32
+#
+# Converters to and from pklite tables live at the bottom, with a small CLI:
+#   python3 animfile.py from-pklite db.sqlite3 anim1 out.wpa --width 10 --height 20 --fps 30 --layout serpentine
+#   python3 animfile.py to-pklite out.wpa db.sqlite3 anim2 --delta 30
+
+import argparse
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from layout import Layout
+
+ANIM_MAGIC = b'WPAN'
+ANIM_VERSION = 1
+ANIM_HEADER = struct.Struct('<4sBBHHfI')
+
+
+class AnimationFormatError(ValueError):
+    pass
+
+
+class AnimationWriter:
+    def __init__(self, path, width, height, fps):
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_size = width * height * 3
+        self.frame_count = 0
+        self.fp = self.path.open('wb')
+        self._write_header()
+
+    def _write_header(self):
+        self.fp.seek(0)
+        self.fp.write(ANIM_HEADER.pack(ANIM_MAGIC, ANIM_VERSION, 0, self.width, self.height, self.fps, self.frame_count))
+
+    def write(self, frame):
+        # frame is strip-order RGB: bytes, a memoryview or an (n, 3) uint8 array
+        raw = frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame)
+        if len(raw) != self.frame_size:
+            raise AnimationFormatError(f"Frame is {len(raw)} bytes, expected {self.frame_size}.")
+        self.fp.write(raw)
+        self.frame_count += 1
+
+    def close(self):
+        if self.fp.closed:
+            return
+        self._write_header() # now that we know how many frames there are
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AnimationFile:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.fp = self.path.open('rb')
+        try:
+            self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            self.fp.close()
+            raise AnimationFormatError("Animation file is empty.")
+        try:
+            magic, version, flags, width, height, fps, frame_count = ANIM_HEADER.unpack_from(self.map)
+        except struct.error:
+            self.close()
+            raise AnimationFormatError("Animation file is too short to have a header.")
+        if magic != ANIM_MAGIC or version > ANIM_VERSION:
+            self.close()
+            raise AnimationFormatError("Not a wallpretty animation, or from a newer version.")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_size = width * height * 3
+        self.frame_count = min(frame_count, (len(self.map) - ANIM_HEADER.size) // self.frame_size if self.frame_size else 0)
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, i):
+        # O(1): a read-only slice of the mapped file, no copy
+        if not -self.frame_count <= i < self.frame_count:
+            raise IndexError(i)
+        i %= self.frame_count
+        start = ANIM_HEADER.size + i * self.frame_size
+        return self.view[start:start + self.frame_size]
+
+    def __iter__(self):
+        for i in range(self.frame_count):
+            yield self.frame(i)
+
+    def loop(self, start=0):
+        # endless playback from any frame
+        if not self.frame_count:
+            return
+        i = start % self.frame_count
+        while True:
+            yield self.frame(i)
+            i = (i + 1) % self.frame_count
+
+    def close(self):
+        view = getattr(self, "view", None)
+        if view is not None:
+            view.release()
+            self.view = None
+        if getattr(self, "map", None) is not None and not self.map.closed:
+            try:
+                self.map.close()
+            except BufferError:
+                pass # someone still holds a frame slice; the map goes away with the last one
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def to_strip(pixels, width, height, layout=None):
+    # a pklite frame as strip-order RGB: either pixelState-shaped (needs a layout) or a flat list of [r, g, b]
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    if pixels.ndim == 3:
+        if layout is None:
+            raise AnimationFormatError("Grid-shaped frames need a layout to put them in strip order.")
+        if not isinstance(layout, Layout):
+            layout = Layout.from_pgrid(layout)
+        return layout.to_strip(pixels, width * height)
+    return pixels.reshape(width * height, 3)
+
+
+def from_pklite(db, table_name, path, width, height, fps, layout=None):
+    import pklite
+    store = pklite.open_store(db, table_name)
+    with AnimationWriter(path, width, height, fps) as writer:
+        for frame, pixels in store.iter_frames():
+            writer.write(to_strip(pixels, width, height, layout))
+    return writer.frame_count
+
+
+def to_pklite(path, db, table_name, batch=256, keyframe_interval=None):
+    # frames come back as flat lists of [r, g, b] in strip order; keyframe_interval stores deltas
+    import pklite
+    if keyframe_interval:
+        store = pklite.DeltaFrameStore(db, table_name, keyframe_interval)
+    else:
+        store = pklite.FrameStore(db, table_name)
+    with AnimationFile(path) as anim:
+        frames = []
+        start = 0
+        for i in range(len(anim)):
+            frames.append(np.frombuffer(anim.frame(i), dtype=np.uint8).reshape(-1, 3).tolist())
+            if len(frames) == batch:
+                store.save_frames(frames, start)
+                start += len(frames)
+                frames = []
+        store.save_frames(frames, start)
+        return len(anim)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between pklite tables and .wpa animation files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_from = sub.add_parser("from-pklite", help="write a pklite table out as a .wpa file")
+    p_from.add_argument("db")
+    p_from.add_argument("table")
+    p_from.add_argument("path")
+    p_from.add_argument("--width", type=int, default=10, help="columns on the board (default=10)")
+    p_from.add_argument("--height", type=int, default=20, help="rows on the board (default=20)")
+    p_from.add_argument("--fps", type=float, default=30, help="playback rate to record (default=30)")
+    p_from.add_argument("--layout", default=None, help="LED wiring for grid-shaped frames: serpentine, progressive[:start[:degrees]] or a .json map (default=serpentine)")
+    p_to = sub.add_parser("to-pklite", help="load a .wpa file into a pklite table")
+    p_to.add_argument("path")
+    p_to.add_argument("db")
+    p_to.add_argument("table")
+    p_to.add_argument("--delta", type=int, default=0, metavar="N", help="store frames as deltas with a keyframe every N frames (default=off)")
+    args = parser.parse_args()
+    if args.command == "from-pklite":
+        layout = Layout.from_spec(args.layout, args.width * args.height, args.width)
+        count = from_pklite(args.db, args.table, args.path, args.width, args.height, args.fps, layout)
+    else:
+        count = to_pklite(args.path, args.db, args.table, keyframe_interval=args.delta)
+    print(f"converted {count} frame{'' if count == 1 else 's'}")
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# Benchmarks, run headless against the virtual strip (see virtual.py).
+#   effects        every ws2801_funcs.py effect: frames/sec and per-frame compute at each size,
+#                  plus a paced pewpew.py shot that has to be shown in full (exits 1 if not)
+#   mapping        board -> strip conversion: nested pgrid lookups vs Layout, and wheel()
+#   serialization  save/load round trips, snapshot and pixel message encoding, delta frames
+#   websocket      the real websocket-quart.py app with many in-process clients (needs quart),
+#                  after a check that coalescing keeps each client's messages in order
+# Results go to JSON so runs on different commits can be compared:
+#   python3 bench.py --output before.json
+#   python3 bench.py --output after.json --compare before.json
+#
+# Effects run unpaced with their waits skipped, so the numbers are compute only; each
+# result also carries the modeled SPI time per frame and the fps that leaves on hardware.
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+import delta
+import effects
+import saves
+import wire
+from fanout import ClientOutbox
+from framebuffer import FrameBuffer, write_strip, show_frame
+from layout import Layout
+from player import Player
+from virtual import VirtualWS2801, RGB_to_color, DEFAULT_SPI_HZ
+
+
+class FrameLimit(Exception):
+    pass
+
+
+class BenchDevice(VirtualWS2801):
+    # a virtual strip that times the gaps between show() calls and stops the effect after max_frames
+    def __init__(self, count, spi_hz, max_frames):
+        super().__init__(count, spi_hz=spi_hz, history=1, realtime=False)
+        self.max_frames = max_frames
+        self.intervals = []
+        self.last_show = None
+
+    def show(self):
+        now = time.perf_counter()
+        if self.last_show is not None:
+            self.intervals.append(now - self.last_show)
+        super().show()
+        self.last_show = time.perf_counter()
+        if self.shown >= self.max_frames:
+            raise FrameLimit()
+
+
+@contextmanager
+def skipped_sleeps():
+    # effects wait between frames; skip the waits so only compute is measured.  time.monotonic()
+    # moves on by what was skipped, so a paced Player sees its frames on time and doesn't pile up waits
+    real_sleep, real_monotonic = time.sleep, time.monotonic
+    skipped = [0.0]
+
+    def sleep(seconds):
+        skipped[0] += max(0.0, seconds)
+
+    time.sleep = sleep
+    time.monotonic = lambda: real_monotonic() + skipped[0]
+    try:
+        yield skipped
+    finally:
+        time.sleep, time.monotonic = real_sleep, real_monotonic
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def per_call(fn, min_time=0.2, repeat=3):
+    # best-of-repeat seconds per call, calling fn enough times to fill min_time
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / 10 or calls >= 1 << 20:
+            break
+        calls *= 4
+    best = elapsed / calls
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - started) / calls)
+    return best
+
+
+def load_ws2801_funcs():
+    # imported for its effect wrappers, which run on whatever device they're handed; importing it opens none
+    import ws2801_funcs
+    return ws2801_funcs
+
+
+def bench_effects(sizes, spi_hz, max_frames, log):
+    funcs = load_ws2801_funcs()
+
+    def unpaced(pixels, frames, wait, label="play"):
+        return Player(None).play(frames, lambda frame: show_frame(pixels, frame), label=label)
+
+    cases = [
+        ("initial", lambda px: funcs.initial(px, 'j')),
+        ("rainbow_cycle_successive", lambda px: funcs.rainbow_cycle_successive(px, wait=0)),
+        ("rainbow_cycle", lambda px: funcs.rainbow_cycle(px, wait=0)),
+        ("rainbow_colors", lambda px: funcs.rainbow_colors(px, wait=0)),
+        ("brightness_decrease", lambda px: funcs.brightness_decrease(px, wait=0)),
+        ("blink_color", lambda px: funcs.blink_color(px, blink_times=2, wait=0)),
+        ("checker_board", lambda px: funcs.checker_board(px, blink_times=2, wait=0)),
+        ("appear_from_back", lambda px: funcs.appear_from_back(px)),
+        ("pew", lambda px: funcs.play(px, effects.pew_frames(px.count(), (255, 0, 0), 0, px.count()), 0)), # pewpew.py's, via effects.py
+    ]
+    results = []
+    real_play = funcs.play
+    funcs.play = unpaced
+    try:
+        for size in sizes:
+            for name, run in cases:
+                funcs.frame_cache.clear() # every run renders its frames from scratch
+                device = BenchDevice(size, spi_hz, max_frames)
+                device.set_pixels_rgb(255, 255, 255) # something for brightness_decrease to fade
+                with skipped_sleeps() as skipped:
+                    started = time.perf_counter()
+                    try:
+                        run(device)
+                    except FrameLimit:
+                        pass
+                    elapsed = time.perf_counter() - started
+                frames = device.shown
+                frame_ms = [interval * 1000 for interval in device.intervals]
+                mean_ms = statistics.fmean(frame_ms) if frame_ms else elapsed * 1000
+                result = {
+                    "name": name,
+                    "pixels": size,
+                    "frames": frames,
+                    "truncated": frames >= max_frames,
+                    "seconds": round(elapsed, 4),
+                    "fps": round(frames / elapsed, 1) if elapsed > 0 else 0.0,
+                    "frame_ms_mean": round(mean_ms, 4),
+                    "frame_ms_p50": round(percentile(frame_ms, 0.5), 4),
+                    "frame_ms_p95": round(percentile(frame_ms, 0.95), 4),
+                    "frame_ms_max": round(max(frame_ms), 4) if frame_ms else 0.0,
+                    "transfer_ms": round(device.transfer_seconds * 1000, 3),
+                    "device_fps": round(1000 / (mean_ms + device.transfer_seconds * 1000), 1),
+                    "skipped_sleep_s": round(skipped[0], 3),
+                }
+                log(f"effects {name:>26} {size:>5} px: {result['fps']:>10.1f} fps, {result['frame_ms_mean']:.3f} ms/frame")
+                results.append(result)
+    finally:
+        funcs.play = real_play
+    return results
+
+
+def check_pew_sweep(log, count=50):
+    # pewpew.py asks for 100000 fps; every show() is late, so a Player that drops late frames
+    # used to skip the whole shot and leave a pixel lit.  Played for real, paced, on a realtime strip.
+    funcs = load_ws2801_funcs()
+    expected = sum(1 for _ in effects.pew_frames(count, (255, 0, 0), 0, count))
+    device = VirtualWS2801(count, history=1)
+    stats = funcs.play(device, effects.pew_frames(count, (255, 0, 0), 0, count), 1 / 100000, "pew")
+    lit = [n for n in range(count) if device.get_pixel(n)]
+    result = {"name": "pew_full_sweep", "pixels": count, "frames": device.shown, "expected": expected,
+              "dropped": stats.dropped, "lit_after": lit, "ok": device.shown == expected and not lit}
+    log(f"effects {'pew_full_sweep':>26} {count:>5} px: {device.shown}/{expected} frames shown, "
+        f"{'ok' if result['ok'] else 'FAILED, lit after: ' + str(lit)}")
+    return result
+
+
+def bench_mapping(sizes, log):
+    funcs = load_ws2801_funcs()
+    results = []
+    for size in sizes:
+        width = 10
+        layout = Layout.from_spec(None, size, width)
+        pgrid = layout.pgrid
+        device = VirtualWS2801(size, realtime=False)
+        frame = FrameBuffer(layout.width, layout.height, layout)
+        frame.pixels[...] = np.random.default_rng(0).integers(0, 256, frame.pixels.shape, dtype=np.uint8)
+        columns = frame.tolist()
+
+        def pgrid_loop():
+            # what the scripts used to do: nested list lookups and a set_pixel per pixel
+            for x in range(layout.width):
+                for y in range(layout.height):
+                    r, g, b = columns[x][y]
+                    device.set_pixel(pgrid[x][y], RGB_to_color(r, g, b))
+
+        cases = [
+            ("pgrid_set_pixel", pgrid_loop),
+            ("layout_to_strip", lambda: layout.to_strip(frame.pixels)),
+            ("layout_write_strip", lambda: write_strip(device, frame.to_strip(size))),
+            ("layout_from_strip", lambda: layout.from_strip(device._pixels)),
+        ]
+        for name, fn in cases:
+            seconds = per_call(fn)
+            results.append({"name": name, "pixels": size, "per_call_us": round(seconds * 1e6, 3)})
+            log(f"mapping {name:>28} {size:>5} px: {seconds * 1e6:>12.1f} us")
+    seconds = per_call(lambda: funcs.wheel(123))
+    results.append({"name": "wheel", "pixels": 1, "per_call_us": round(seconds * 1e6, 3)})
+    log(f"mapping {'wheel':>28} {1:>5} px: {seconds * 1e6:>12.3f} us")
+    return results
+
+
+def bench_serialization(sizes, log):
+    results = []
+
+    def record(name, size, fn, nbytes=None):
+        seconds = per_call(fn)
+        result = {"name": name, "pixels": size, "per_call_us": round(seconds * 1e6, 3)}
+        if nbytes is not None:
+            result["bytes"] = nbytes
+        results.append(result)
+        log(f"serialization {name:>22} {size:>5} px: {seconds * 1e6:>12.1f} us" + (f", {nbytes} bytes" if nbytes is not None else ""))
+
+    with tempfile.TemporaryDirectory() as save_dir:
+        for size in sizes:
+            width = 10
+            height = size // width
+            frame = FrameBuffer(width, height)
+            frame.pixels[...] = np.random.default_rng(1).integers(0, 256, frame.pixels.shape, dtype=np.uint8)
+            frame.pixels[:, height // 2:] = 0 # half painted, half dark, like a real board
+            rgb = frame.tobytes()
+            meta = {"name": "bench", "slug": f"bench-{size}", "width": width, "height": height}
+            packed = saves.encode_save(meta, rgb, True)
+            raw = saves.encode_save(meta, rgb, False)
+            legacy = json.dumps({"name": "bench", "pixels": frame.tolist()})
+            record("save_encode_zlib", size, lambda: saves.encode_save(meta, rgb, True), len(packed))
+            record("save_encode_raw", size, lambda: saves.encode_save(meta, rgb, False), len(raw))
+            record("save_decode_zlib", size, lambda: saves.decode_save(packed))
+            record("save_legacy_json_dump", size, lambda: json.dumps({"name": "bench", "pixels": frame.tolist()}), len(legacy))
+            record("save_legacy_json_load", size, lambda: FrameBuffer.from_list(json.loads(legacy)["pixels"]))
+
+            def round_trip():
+                path = saves.write_save(save_dir, meta, rgb, True)
+                saves.read_save(path)
+
+            record("save_round_trip_disk", size, round_trip)
+            snapshot_json = json.dumps({"Type": "Snapshot", "Data": {"Width": width, "Height": height, "Pixels": frame.tolist()}}, separators=(',', ':'))
+            record("snapshot_json", size, lambda: json.dumps({"Type": "Snapshot", "Data": {"Width": width, "Height": height, "Pixels": frame.tolist()}}, separators=(',', ':')), len(snapshot_json))
+            record("snapshot_binary", size, lambda: wire.encode_frame(width, height, frame.tobytes()), len(wire.encode_frame(width, height, rgb)))
+            moved = bytearray(rgb)
+            moved[0:3] = b'\x01\x02\x03'
+            moved = bytes(moved)
+            step = delta.encode_delta(rgb, moved)
+            record("delta_encode_one_pixel", size, lambda: delta.encode_delta(rgb, moved), len(step))
+            record("delta_apply_one_pixel", size, lambda: delta.apply_delta(rgb, step))
+    x, y, r, g, b = 3, 19, 255, 165, 0
+    record("pixel_message_fstring", 1, lambda: f'{{"Type":"Pixel","Data":[{x}, {y}, {r}, {g}, {b}]}}')
+    record("pixel_message_json_dumps", 1, lambda: json.dumps({"Type": "Pixel", "Data": [x, y, r, g, b]}))
+    record("pixel_message_binary", 1, lambda: wire.encode_pixels([(x, y, r, g, b)]))
+    return results
+
+
+def load_server():
+    # websocket-quart.py has a dash in its name, so load it by path; it parses its own argv
+    argv = sys.argv
+    sys.argv = [str(HERE / "websocket-quart.py"), "--virtual"]
+    try:
+        spec = importlib.util.spec_from_file_location("websocket_quart", HERE / "websocket-quart.py")
+        module = importlib.util.module_from_spec(spec)
+        with redirect_stdout(sys.stderr): # its startup chatter would end up in the results JSON
+            spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+async def websocket_case(client, clients, messages, binary, timeout):
+    # one sender paints `messages` distinct pixels; every viewer must see all of them
+    loop = asyncio.get_running_loop()
+    sent_at = {}
+    latencies = []
+    ready = [loop.create_future() for _ in range(clients)]
+    done = [loop.create_future() for _ in range(clients)]
+
+    def pixel(i):
+        return (i % 10, (i // 10) % 20) # distinct, so the coalesce policy never merges two of them
+
+    async def viewer(ready, done):
+        async with client.websocket('/ws') as ws:
+            if binary:
+                await ws.send(json.dumps({"Type": "Protocol", "Data": "binary"}))
+                while json.loads(await ws.receive()).get("Type") != "Protocol":
+                    pass
+            ready.set_result(True)
+            seen = 0
+            try:
+                while seen < messages:
+                    message = await asyncio.wait_for(ws.receive(), timeout)
+                    now = time.perf_counter()
+                    if isinstance(message, bytes):
+                        records = wire.decode_pixels(message) if wire.opcode(message) == wire.OP_PIXELS else []
+                    else:
+                        decoded = json.loads(message)
+                        records = [decoded["Data"]] if decoded.get("Type") == "Pixel" else []
+                    for x, y, *_ in records:
+                        latencies.append(now - sent_at[(x, y)])
+                        seen += 1
+            except asyncio.TimeoutError:
+                pass
+            done.set_result(seen)
+
+    viewers = [asyncio.ensure_future(viewer(r, d)) for r, d in zip(ready, done)]
+    await asyncio.gather(*ready)
+    async with client.websocket('/ws') as sender:
+        if binary:
+            await sender.send(json.dumps({"Type": "Protocol", "Data": "binary"}))
+        started = time.perf_counter()
+        for i in range(messages):
+            x, y = pixel(i)
+            sent_at[(x, y)] = time.perf_counter()
+            if binary:
+                await sender.send(wire.encode_pixels([(x, y, i % 256, 0, 0)]))
+            else:
+                await sender.send(json.dumps({"Type": "Pixel", "Data": [x, y, i % 256, 0, 0]}))
+        received = await asyncio.gather(*done)
+        elapsed = time.perf_counter() - started
+    await asyncio.gather(*viewers)
+    return {
+        "name": "pixel_fanout_binary" if binary else "pixel_fanout_json",
+        "clients": clients,
+        "messages": messages,
+        "delivered": sum(received),
+        "expected": clients * messages,
+        "seconds": round(elapsed, 4),
+        "deliveries_per_s": round(sum(received) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms_mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "latency_ms_p95": round(percentile(latencies, 0.95) * 1000, 3),
+    }
+
+
+async def update_case(client, clients):
+    # every client asks for the whole board at once
+    async def ask():
+        async with client.websocket('/ws') as ws:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"Type": "Update"}))
+            while json.loads(await ws.receive()).get("Type") != "Snapshot":
+                pass
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(ask() for _ in range(clients)))
+    return {
+        "name": "snapshot_update",
+        "clients": clients,
+        "seconds": round(time.perf_counter() - started, 4),
+        "latency_ms_mean": round(statistics.fmean(latencies) * 1000, 3),
+        "latency_ms_p95": round(percentile(latencies, 0.95) * 1000, 3),
+    }
+
+
+def check_outbox_order(log):
+    # coalescing must not let a newer pixel jump ahead of a message queued after the one it replaces:
+    # red (1,2), an all-black Snapshot, blue (1,2) has to arrive with the Snapshot before blue
+    class Recorder:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, message):
+            self.sent.append(message)
+
+    async def deliver(maxsize, puts):
+        websock = Recorder()
+        outbox = ClientOutbox(websock, maxsize=maxsize, policy="coalesce")
+        for message, key in puts:
+            outbox.put(message, key)
+        writer = asyncio.ensure_future(outbox.run())
+        while outbox.queue:
+            await asyncio.sleep(0)
+        outbox.close()
+        await writer
+        return websock.sent
+
+    barrier = [("red", ("Pixel", 1, 2)), ("snapshot", None), ("blue", ("Pixel", 1, 2))]
+    cases = [
+        ("room", 8, barrier, ["red", "snapshot", "blue"]),
+        ("full", 2, barrier, ["snapshot", "blue"]), # nothing mergeable across the Snapshot; drops the oldest
+        ("merge", 2, [("red", ("Pixel", 1, 2)), ("green", ("Pixel", 3, 4)), ("blue", ("Pixel", 1, 2))], ["blue", "green"]),
+    ]
+    wrong = {}
+    for name, maxsize, puts, expected in cases:
+        sent = asyncio.run(deliver(maxsize, puts))
+        if sent != expected:
+            wrong[name] = sent
+    result = {"name": "outbox_order", "clients": 1, "cases": len(cases), "wrong": wrong, "ok": not wrong}
+    log(f"websocket {'outbox_order':>22} {1:>4} clients: {'ok' if not wrong else 'FAILED, delivered ' + str(wrong)}")
+    return result
+
+
+def bench_websocket(client_counts, messages, timeout, log):
+    checks = [check_outbox_order(log)]
+    if importlib.util.find_spec("quart") is None:
+        log("websocket: skipped, quart is not installed")
+        return checks
+    server = load_server()
+
+    async def run():
+        results = []
+        async with server.app.test_app() as test_app:
+            client = test_app.test_client()
+            for clients in client_counts:
+                for binary in (False, True):
+                    result = await websocket_case(client, clients, messages, binary, timeout)
+                    log(f"websocket {result['name']:>22} {clients:>4} clients: {result['deliveries_per_s']:>10.1f} deliveries/s, "
+                        f"{result['latency_ms_mean']:.2f} ms mean latency ({result['delivered']}/{result['expected']})")
+                    results.append(result)
+                result = await update_case(client, clients)
+                log(f"websocket {result['name']:>22} {clients:>4} clients: {result['latency_ms_mean']:.2f} ms mean latency")
+                results.append(result)
+        return results
+
+    return checks + asyncio.run(run())
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit or None,
+        "when": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def flatten(results):
+    # {"section/name/size": {metric: value}} for comparing two runs
+    flat = {}
+    for section, entries in results.items():
+        if not isinstance(entries, list):
+            continue
+        for entry in entries:
+            size = entry.get("pixels", entry.get("clients"))
+            flat[f"{section}/{entry['name']}/{size}"] = entry
+    return flat
+
+
+# which way is better for each metric we compare
+HIGHER_IS_BETTER = {"fps": True, "deliveries_per_s": True, "per_call_us": False, "frame_ms_mean": False, "latency_ms_mean": False}
+
+
+def compare(old, new, log, threshold=0.1):
+    old_flat, new_flat = flatten(old), flatten(new)
+    regressions = 0
+    for key in sorted(new_flat.keys() & old_flat.keys()):
+        for metric, higher_better in HIGHER_IS_BETTER.items():
+            before, after = old_flat[key].get(metric), new_flat[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change < -threshold if higher_better else change > threshold
+            regressions += worse
+            log(f"{'REGRESSION ' if worse else ''}{key} {metric}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark wallpretty headless against a virtual LED strip")
+    parser.add_argument("--sizes", default="200,1000,5000", help="pixel counts to run effects and mapping at (default=200,1000,5000)")
+    parser.add_argument("--only", default="effects,mapping,serialization,websocket", help="comma separated sections to run (default=all)")
+    parser.add_argument("--max-frames", type=int, default=2000, help="stop each effect after this many frames (default=2000)")
+    parser.add_argument("--spi-hz", type=int, default=DEFAULT_SPI_HZ, help=f"SPI clock for the modeled transfer time (default={DEFAULT_SPI_HZ})")
+    parser.add_argument("--clients", default="1,10,50", help="websocket client counts (default=1,10,50)")
+    parser.add_argument("--messages", type=int, default=200, help="pixels each websocket run paints (default=200, the most a 10x20 board has)")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds a websocket client waits for a message (default=10)")
+    parser.add_argument("--output", default=None, help="write results JSON here (default=stdout)")
+    parser.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress lines on stderr")
+    args = parser.parse_args()
+
+    def log(line):
+        if not args.quiet:
+            print(line, file=sys.stderr, flush=True)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sections = set(args.only.split(","))
+    results = {"environment": environment(), "settings": {"sizes": sizes, "max_frames": args.max_frames, "spi_hz": args.spi_hz}}
+    if "effects" in sections:
+        results["effects"] = bench_effects(sizes, args.spi_hz, args.max_frames, log)
+        results["effects"].append(check_pew_sweep(log))
+    if "mapping" in sections:
+        results["mapping"] = bench_mapping(sizes, log)
+    if "serialization" in sections:
+        results["serialization"] = bench_serialization(sizes, log)
+    if "websocket" in sections:
+        results["websocket"] = bench_websocket([int(n) for n in args.clients.split(",")], args.messages, args.timeout, log)
+
+    failed = [entry["name"] for section in ("effects", "websocket") for entry in results.get(section, []) if entry.get("ok") is False]
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    if failed:
+        log(f"FAILED: {', '.join(failed)}")
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, log)
+        log(f"{regressions} regression{'' if regressions == 1 else 's'} over 10%")
+        return 1 if regressions or failed else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
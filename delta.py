@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Inter-frame delta coding for RGB frames.
+# Most of what the wall shows changes a handful of pixels per frame (paint strokes, pew()
+# shots, letters being drawn), so instead of whole frames we keep runs of changed pixels
+# against the frame before.  Every keyframe_interval frames, or whenever a delta would not
+# be smaller, a full keyframe goes out instead so readers can seek and resync.
+#
+#   keyframe: 0x00, then the whole frame
+#   delta:    0x01, then runs of start:u16 length:u16 and length RGB triples
+#
+# Frames are flat RGB bytes of any pixel order; the codec only cares that consecutive
+# frames use the same one.  pklite.DeltaFrameStore and the server's animation stream use it.
+
+import struct
+
+import numpy as np
+
+KEYFRAME = 0x00
+DELTA = 0x01
+RUN_HEADER = struct.Struct('<HH')
+MAX_PIXELS = 0xFFFF # run starts are u16; bigger frames always go out as keyframes
+MERGE_GAP = 1 # unchanged pixels worth sending to save a run header (3 bytes each vs 4)
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def _pixels(frame):
+    return np.frombuffer(frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame), dtype=np.uint8).reshape(-1, 3)
+
+
+def changed_runs(prev, frame):
+    # [(start, length), ...] covering every pixel that differs, short gaps folded in
+    changed = np.flatnonzero(np.any(_pixels(prev) != _pixels(frame), axis=1))
+    if not len(changed):
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > MERGE_GAP + 1)
+    starts = changed[np.concatenate(([0], breaks + 1))]
+    ends = changed[np.concatenate((breaks, [len(changed) - 1]))] + 1
+    return list(zip(starts.tolist(), (ends - starts).tolist()))
+
+
+def encode_keyframe(frame):
+    return bytes([KEYFRAME]) + (frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame))
+
+
+def encode_delta(prev, frame):
+    # a delta from prev to frame, or a keyframe when that is smaller or there is nothing to diff against
+    raw = frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame)
+    if prev is None or len(prev) != len(raw) or len(raw) // 3 > MAX_PIXELS:
+        return encode_keyframe(raw)
+    out = bytearray([DELTA])
+    for start, length in changed_runs(prev, raw):
+        out += RUN_HEADER.pack(start, length)
+        out += raw[start * 3:(start + length) * 3]
+        if len(out) > len(raw):
+            return encode_keyframe(raw)
+    return bytes(out)
+
+
+def is_keyframe(payload):
+    return bool(payload) and payload[0] == KEYFRAME
+
+
+def apply_delta(prev, payload):
+    # the frame payload describes, as a new bytearray; prev is only needed for deltas
+    if not payload:
+        raise DeltaError("Empty delta payload.")
+    body = memoryview(payload)[1:]
+    if payload[0] == KEYFRAME:
+        return bytearray(body)
+    if payload[0] != DELTA:
+        raise DeltaError(f"Unknown delta kind {payload[0]}.")
+    if prev is None:
+        raise DeltaError("Delta frame without a keyframe before it.")
+    frame = bytearray(prev)
+    offset = 0
+    while offset < len(body):
+        if offset + RUN_HEADER.size > len(body):
+            raise DeltaError("Truncated run header.")
+        start, length = RUN_HEADER.unpack_from(body, offset)
+        offset += RUN_HEADER.size
+        end = offset + length * 3
+        if end > len(body) or (start + length) * 3 > len(frame):
+            raise DeltaError("Run runs past the end of the frame.")
+        frame[start * 3:(start + length) * 3] = body[offset:end]
+        offset = end
+    return frame
+
+
+class DeltaEncoder:
+    # one stream of frames; keyframe_interval=0 means only the first frame is a keyframe
+    def __init__(self, keyframe_interval=30):
+        self.keyframe_interval = keyframe_interval
+        self.prev = None
+        self.since_keyframe = 0
+
+    def force_keyframe(self):
+        self.prev = None
+
+    def encode(self, frame):
+        raw = frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame)
+        due = self.keyframe_interval and self.since_keyframe >= self.keyframe_interval
+        payload = encode_keyframe(raw) if due else encode_delta(self.prev, raw)
+        self.since_keyframe = 1 if is_keyframe(payload) else self.since_keyframe + 1
+        self.prev = raw
+        return payload
+
+
+class DeltaDecoder:
+    def __init__(self):
+        self.frame = None
+
+    def decode(self, payload):
+        self.frame = apply_delta(self.frame, payload)
+        return self.frame
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Vectorized effect engine.
+# Every effect is a generator of whole frames: (count, 3) uint8 arrays in strip order.
+# Colors come from a precomputed 256-entry wheel table, so a frame is a single
+# index-arithmetic lookup instead of a wheel() call per pixel.  The functions in
+# ws2801_funcs.py and test.py are thin wrappers that push these frames to the strip.
+# Generators may hand back the same array on every step, so copy a frame if you keep it.
+
+import numpy as np
+
+
+def build_wheel():
+    # same hues as ws2801_funcs.wheel(): red -> green -> blue -> red
+    pos = np.arange(256)
+    wheel = np.zeros((256, 3), dtype=np.uint8)
+    a = pos[:85]
+    wheel[:85] = np.stack([a * 3, 255 - a * 3, np.zeros_like(a)], axis=1)
+    b = pos[85:170] - 85
+    wheel[85:170] = np.stack([255 - b * 3, np.zeros_like(b), b * 3], axis=1)
+    c = pos[170:] - 170
+    wheel[170:] = np.stack([np.zeros_like(c), c * 3, 255 - c * 3], axis=1)
+    return wheel
+
+WHEEL = build_wheel()
+
+
+def solid(count, color):
+    frame = np.empty((count, 3), dtype=np.uint8)
+    frame[:] = color
+    return frame
+
+
+def rainbow_cycle_successive_frames(count, start=None):
+    # fill the strip one pixel at a time with its slice of the wheel
+    frame = np.zeros((count, 3), dtype=np.uint8) if start is None else np.array(start, dtype=np.uint8).reshape(count, 3)
+    hues = WHEEL[(np.arange(count) * 256 // count) % 256]
+    for i in range(count):
+        frame[i] = hues[i]
+        yield frame
+
+
+def rainbow_cycle_frames(count, steps=256):
+    # the whole wheel spread across the strip, rotated one step per frame
+    offsets = np.arange(count) * 256 // count
+    for j in range(steps):
+        yield WHEEL[(offsets + j) % 256]
+
+
+def rainbow_colors_frames(count, steps=256):
+    # every pixel the same hue, walking around the wheel
+    base = 256 // count
+    for j in range(steps):
+        yield solid(count, WHEEL[(base + j) % 256])
+
+
+def brightness_decrease_frames(start, step=1):
+    # fade whatever is on the strip down to black
+    frame = np.array(start, dtype=np.int16).reshape(-1, 3)
+    for j in range(int(256 // step)):
+        frame = np.maximum(frame - step, 0)
+        yield frame.astype(np.uint8)
+
+
+def blink_frames(count, color=(255, 0, 0)):
+    # one blink: on, off, on, off
+    on = solid(count, color)
+    off = np.zeros((count, 3), dtype=np.uint8)
+    for j in range(2):
+        yield on
+        yield off
+
+
+def checker_board_frames(count, color=(255, 0, 0)):
+    # one blink: odd pixels, even pixels, odd pixels, even pixels
+    odd = np.zeros((count, 3), dtype=np.uint8)
+    odd[1::2] = color
+    even = np.zeros((count, 3), dtype=np.uint8)
+    even[0::2] = color
+    for j in range(2):
+        yield odd
+        yield even
+
+
+def appear_from_back_frames(count, color=(255, 0, 0)):
+    # each pixel travels down from the far end and stacks onto the ones already there
+    frame = np.zeros((count, 3), dtype=np.uint8)
+    for i in range(count):
+        for j in reversed(range(i, count)):
+            frame[i:] = 0
+            frame[j] = color
+            yield frame
+        frame[i] = color
+
+
+def pew_frames(count, color=(255, 0, 0), start=0, end=None):
+    # a single pixel shot from start towards end
+    if end is None:
+        end = count
+    frame = np.zeros((count, 3), dtype=np.uint8)
+    if start < end:
+        inc = 1
+    else:
+        inc = -1
+        start -= 1
+        end -= 1
+    for i in range(start, end, inc):
+        frame[:] = 0
+        frame[i] = color
+        yield frame
+    frame[:] = 0
+    yield frame
+
+
+def crossfade_frames(start, end, steps):
+    # blend linearly from one strip frame to another, finishing exactly on end
+    start = np.asarray(start, dtype=np.float32)
+    delta = np.asarray(end, dtype=np.float32) - start
+    for step in range(1, steps + 1):
+        yield np.rint(start + delta * (step / steps)).astype(np.uint8)
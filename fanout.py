@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Per-client outbound queues for websocket fan-out.
+# Every connection gets a bounded queue and its own writer task, so broadcast()
+# only has to enqueue and one slow phone can't hold up the rest of the wall.
+
+import asyncio
+import time
+from collections import deque
+
+# what to do when a client's queue is full:
+#   drop-oldest - throw away the oldest queued message
+#   coalesce    - replace a queued update with the same key (e.g. same pixel) in place,
+#                 and fall back to drop-oldest when nothing can be merged.  Only keyed
+#                 updates queued since the last unkeyed message (a Snapshot, a Pixels
+#                 batch) are merged, so a newer pixel never jumps ahead of a message
+#                 that was queued after the one it replaces
+#   disconnect  - give up on the client and close its socket
+OVERFLOW_POLICIES = ("drop-oldest", "coalesce", "disconnect")
+
+
+class SlowClientError(Exception):
+    pass
+
+
+class ClientOutbox:
+    def __init__(self, websock, maxsize=256, policy="drop-oldest", name=None, delay=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}'.")
+        if maxsize < 1:
+            raise ValueError("Queue size must be at least 1.")
+        self.websock = websock
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name      # shows up in /metrics, see metrics.py
+        self.delay = delay    # optional metrics.Histogram of seconds from put() to send
+        self.queue = deque()  # entries are [key, message, queued at]
+        self.pending = {}     # coalesce key -> newest entry for it queued since the last unkeyed one
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.overflowed = False
+        self.binary = False   # negotiated per connection, see wire.py
+        self.dropped = 0
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, message, key=None):
+        # never blocks; returns False if the message was refused
+        if self.closed:
+            return False
+        if len(self.queue) >= self.maxsize:
+            if self.policy == "disconnect":
+                self.overflowed = True
+                self.close()
+                return False
+            queued = self.pending.get(key) if key is not None and self.policy == "coalesce" else None
+            if queued is not None:
+                queued[1] = message # newer value for the same key wins, keeps its place in line
+                return True
+            self._drop_oldest()
+        entry = [key, message, time.perf_counter()]
+        self.queue.append(entry)
+        if key is None:
+            self.pending.clear() # nothing queued before this may be merged with anything after it
+        elif self.policy == "coalesce":
+            self.pending[key] = entry
+        self.ready.set()
+        return True
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.pending.clear()
+        self.ready.set()
+
+    def _forget(self, entry):
+        if entry[0] is not None and self.pending.get(entry[0]) is entry:
+            del self.pending[entry[0]]
+
+    def _drop_oldest(self):
+        self._forget(self.queue.popleft())
+        self.dropped += 1
+
+    async def run(self):
+        # writer task: drains the queue onto the socket until closed
+        while True:
+            while not self.queue:
+                if self.closed:
+                    break
+                self.ready.clear()
+                await self.ready.wait()
+            if self.closed:
+                break
+            entry = self.queue.popleft()
+            self._forget(entry)
+            key, message, queued = entry
+            await self.websock.send(message)
+            self.sent += 1
+            if self.delay is not None:
+                self.delay.observe(time.perf_counter() - queued)
+        if self.overflowed:
+            await self.websock.close(1008)
+            raise SlowClientError(f"client fell {self.maxsize} messages behind")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# NumPy-backed framebuffer for the wall.
+# pixels is a contiguous (width, height, 3) uint8 array addressed [x, y] like pixelState
+# used to be, and layout (see layout.py) maps every (x, y) to its position on the LED strip
+# so a whole frame can be put in strip order with one gather.
+
+import numpy as np
+
+from layout import Layout
+
+
+class FrameBuffer:
+    def __init__(self, width, height, layout=None, pixels=None):
+        # layout is a layout.Layout, or the nested pgrid[x][y] lists the scripts used to build
+        self.width = width
+        self.height = height
+        if pixels is None:
+            self.pixels = np.zeros((width, height, 3), dtype=np.uint8)
+        else:
+            self.pixels = np.ascontiguousarray(pixels, dtype=np.uint8).reshape(width, height, 3)
+        if layout is not None and not isinstance(layout, Layout):
+            layout = Layout.from_pgrid(layout)
+        if layout is not None and (layout.width, layout.height) != (width, height):
+            raise ValueError(f"Layout is {layout.width}x{layout.height}, frame is {width}x{height}.")
+        self.layout = layout
+        self.strip_index = layout.index if layout is not None else None
+
+    @classmethod
+    def from_bytes(cls, width, height, data, layout=None):
+        # data is x-major RGB, the same layout tobytes() produces; bytes come back as a read-only view
+        return cls(width, height, layout, np.frombuffer(data, dtype=np.uint8))
+
+    @classmethod
+    def from_strip(cls, width, height, strip, layout):
+        # the inverse of to_strip(): strip-order RGB (bytes or an (n, 3) array) back onto the grid
+        frame = cls(width, height, layout)
+        frame.pixels = frame.layout.from_strip(strip)
+        return frame
+
+    @classmethod
+    def from_list(cls, columns, layout=None):
+        # columns is pixelState-shaped: columns[x][y] == [r, g, b]
+        pixels = np.asarray(columns, dtype=np.uint8)
+        return cls(pixels.shape[0], pixels.shape[1], layout, pixels)
+
+    def copy(self):
+        frame = FrameBuffer(self.width, self.height, self.layout, self.pixels.copy())
+        return frame
+
+    def fill(self, rgb=(0, 0, 0)):
+        self.pixels[...] = rgb
+
+    def load(self, other):
+        # copy another frame in; if the sizes differ the overlap is kept and the rest goes dark
+        width = min(self.width, other.width)
+        height = min(self.height, other.height)
+        if (width, height) != (self.width, self.height):
+            self.pixels[...] = 0
+        self.pixels[:width, :height] = other.pixels[:width, :height]
+
+    def set_pixels(self, records):
+        # records is a sequence of (x, y, r, g, b); later duplicates win
+        records = np.asarray(records, dtype=np.intp).reshape(-1, 5)
+        self.pixels[records[:, 0], records[:, 1]] = records[:, 2:5]
+
+    def diff(self, other):
+        # (x, y) of every pixel that differs from other, as an (n, 2) array
+        return np.argwhere(np.any(self.pixels != other.pixels, axis=2))
+
+    def tolist(self):
+        return self.pixels.tolist()
+
+    def tobytes(self):
+        return self.pixels.tobytes()
+
+    def to_strip(self, count=None):
+        # (count, 3) array in LED strip order; LEDs without a grid position stay dark
+        if self.layout is None:
+            raise ValueError("FrameBuffer has no layout.")
+        return self.layout.to_strip(self.pixels, count)
+
+    def write_to(self, device):
+        write_strip(device, self.to_strip(device.count()))
+
+
+def write_strip(device, strip):
+    # push a strip-order RGB frame (bytes or an (n, 3) array) into the device's buffer
+    strip = np.frombuffer(strip, dtype=np.uint8) if isinstance(strip, (bytes, bytearray, memoryview)) else np.asarray(strip, dtype=np.uint8)
+    strip = strip.reshape(-1)
+    buf = getattr(device, "_pixels", None)
+    if isinstance(buf, list) and len(buf) == strip.size:
+        # Adafruit_WS2801 keeps a flat RGB list and show() hands it straight to SPI
+        buf[:] = strip.tolist()
+    elif isinstance(buf, bytearray) and len(buf) == strip.size:
+        buf[:] = strip.tobytes()
+    else:
+        for n, (r, g, b) in enumerate(strip.reshape(-1, 3).tolist()):
+            device.set_pixel(n, (r << 16) | (g << 8) | b)
+
+
+def read_strip(device):
+    # the device's current contents as a (count, 3) uint8 array in strip order
+    buf = getattr(device, "_pixels", None)
+    if isinstance(buf, (list, bytearray)):
+        return np.array(buf, dtype=np.uint8).reshape(-1, 3)
+    return np.array([device.get_pixel_rgb(n) for n in range(device.count())], dtype=np.uint8).reshape(-1, 3)
+
+
+def show_frame(device, strip, profiler=None):
+    write_strip(device, strip)
+    if profiler is not None:
+        profiler.mark("write") # the rest, device.show(), is charged to "show" by whoever marks next
+    device.show()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Cache of fully rendered effect frame sequences.
+# Deterministic effects (rainbow_cycle, checker_board, blink_color, ...) draw the same
+# frames every time for a given pixel count and parameters, so we render them once into
+# one packed byte buffer and afterwards playback is just slicing and copying.  Entries
+# are evicted least-recently-used once the memory budget is exceeded, and can
+# optionally be spilled to a directory on disk instead of thrown away.
+
+import hashlib
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+SPILL_HEADER = struct.Struct('<4sI') # magic, frame size in bytes
+SPILL_MAGIC = b'WPFC'
+
+
+class CachedEffect:
+    def __init__(self, data, frame_size):
+        if frame_size <= 0 or len(data) % frame_size:
+            raise ValueError("Cached data isn't a whole number of frames.")
+        self.data = data
+        self.frame_size = frame_size
+
+    def __len__(self):
+        return len(self.data) // self.frame_size
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def frame(self, i):
+        start = i * self.frame_size
+        return memoryview(self.data)[start:start + self.frame_size]
+
+    def __iter__(self):
+        view = memoryview(self.data)
+        for start in range(0, len(self.data), self.frame_size):
+            yield view[start:start + self.frame_size]
+
+
+class FrameCache:
+    def __init__(self, budget_bytes=32 * 1024 * 1024, spill_dir=None):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.entries = OrderedDict() # key -> CachedEffect, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock() # effects run on animation worker threads too
+
+    @staticmethod
+    def make_key(name, params, geometry):
+        return (name, tuple(sorted(params.items())), tuple(geometry) if isinstance(geometry, (list, tuple)) else (geometry,))
+
+    def get(self, name, params, geometry, render):
+        # render() is only called on a miss; it returns an iterable of frames (arrays or bytes)
+        key = self.make_key(name, params, geometry)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._load_spilled(key)
+        if entry is None:
+            entry = self._render(render)
+        with self.lock:
+            if key not in self.entries:
+                self._insert(key, entry)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _render(self, render):
+        data = bytearray()
+        frame_size = None
+        for frame in render():
+            raw = frame.tobytes() if hasattr(frame, "tobytes") else bytes(frame)
+            if frame_size is None:
+                frame_size = len(raw)
+            elif len(raw) != frame_size:
+                raise ValueError("Effect produced frames of different sizes.")
+            data += raw
+        return CachedEffect(bytes(data), frame_size or 1)
+
+    def _insert(self, key, entry):
+        if entry.nbytes > self.budget_bytes:
+            self._spill(key, entry) # too big to keep in memory, but still worth keeping on disk
+            return
+        self.entries[key] = entry
+        self.size += entry.nbytes
+        while self.size > self.budget_bytes:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.size -= old_entry.nbytes
+            self.evictions += 1
+            self._spill(old_key, old_entry)
+
+    def _spill_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return self.spill_dir / f"{digest}.frames"
+
+    def _spill(self, key, entry):
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(key)
+        if path.exists():
+            return
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('wb') as fp:
+            fp.write(SPILL_HEADER.pack(SPILL_MAGIC, entry.frame_size))
+            fp.write(entry.data)
+        tmp.replace(path)
+
+    def _load_spilled(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            raw = path.read_bytes()
+            magic, frame_size = SPILL_HEADER.unpack_from(raw)
+            if magic != SPILL_MAGIC:
+                return None
+            return CachedEffect(raw[SPILL_HEADER.size:], frame_size)
+        except (OSError, ValueError, struct.error):
+            return None
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Multi-process serving for websocket-quart.py (--workers N).
+# One owner process drives the LEDs: it has the SPI device, the render loop and the
+# effects, and it is the only process that writes the board.  N web worker processes
+# accept the websockets.  The board lives in shared memory (SharedBoard), so a worker
+# can answer Update requests and save the board without asking anyone.
+#
+# Everything else goes through a Unix socket hub run by the owner.
+#   - Workers pass on client messages that change the board (pixels, chat, effects) and
+#     boards to apply (a loaded save).
+#   - The owner handles them exactly as a single-process server would.
+#   - Every broadcast that results is published to all the workers, and each worker
+#     fans it out to its own clients.
+#   - A worker's own broadcasts (someone connected) go the same way, so every client
+#     sees them.
+#
+# Frames on the socket are a little-endian u32 length followed by the body; the first
+# byte of the body is the op.  Publishes to each worker go through a fanout.ClientOutbox
+# like a websocket client's, so a stalled worker costs a bounded queue, not an ever
+# growing transport buffer: past the limit its updates are coalesced by key, or the
+# oldest dropped.
+
+import asyncio
+import json
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from fanout import ClientOutbox
+
+OP_PUBLISH = 0x01 # a broadcast: owner -> every worker, or worker -> owner to pass on
+OP_MESSAGE = 0x02 # worker -> owner: a client's websocket message for the owner to handle
+OP_BOARD = 0x03   # worker -> owner: a whole board to apply, e.g. a loaded save
+
+HAS_TEXT = 0x01
+HAS_BINARY = 0x02
+
+LENGTH = struct.Struct('<I')
+PUBLISH_HEADER = struct.Struct('<BBHII') # op, flags, key length, text length, binary length
+MESSAGE_HEADER = struct.Struct('<BB')    # op, flags
+BOARD_HEADER = struct.Struct('<BHHf')    # op, width, height, fade seconds
+
+
+class HubError(Exception):
+    pass
+
+
+def encode_publish(text, binary=None, key=None):
+    # text None means the message is only for binary-protocol clients
+    key = json.dumps(key).encode() if key is not None else b''
+    text_bytes = text.encode() if text is not None else b''
+    binary = binary if binary is not None else b''
+    flags = (HAS_TEXT if text is not None else 0) | (HAS_BINARY if binary else 0)
+    return PUBLISH_HEADER.pack(OP_PUBLISH, flags, len(key), len(text_bytes), len(binary)) + key + text_bytes + binary
+
+
+def decode_publish(body):
+    # -> (text, binary, key); key comes back as a tuple so it can be a coalesce key again
+    op, flags, key_len, text_len, binary_len = PUBLISH_HEADER.unpack_from(body)
+    at = PUBLISH_HEADER.size
+    key = tuple(json.loads(body[at:at + key_len])) if key_len else None
+    at += key_len
+    text = body[at:at + text_len].decode() if flags & HAS_TEXT else None
+    at += text_len
+    binary = bytes(body[at:at + binary_len]) if flags & HAS_BINARY else None
+    return text, binary, key
+
+
+def publish_key(body):
+    # just the coalesce key of an encoded publish, for relaying it without decoding the rest
+    key_len = PUBLISH_HEADER.unpack_from(body)[2]
+    return tuple(json.loads(body[PUBLISH_HEADER.size:PUBLISH_HEADER.size + key_len])) if key_len else None
+
+
+def encode_message(data):
+    # a websocket message as received, str or bytes
+    if isinstance(data, str):
+        return MESSAGE_HEADER.pack(OP_MESSAGE, HAS_TEXT) + data.encode()
+    return MESSAGE_HEADER.pack(OP_MESSAGE, HAS_BINARY) + bytes(data)
+
+
+def decode_message(body):
+    op, flags = MESSAGE_HEADER.unpack_from(body)
+    payload = body[MESSAGE_HEADER.size:]
+    return payload.decode() if flags & HAS_TEXT else bytes(payload)
+
+
+def encode_board(width, height, fade, rgb):
+    return BOARD_HEADER.pack(OP_BOARD, width, height, fade) + rgb
+
+
+def decode_board(body):
+    # -> (width, height, fade, rgb)
+    op, width, height, fade = BOARD_HEADER.unpack_from(body)
+    rgb = bytes(body[BOARD_HEADER.size:])
+    if len(rgb) != width * height * 3:
+        raise HubError(f"Board is {width}x{height} but carries {len(rgb)} bytes.")
+    return width, height, fade, rgb
+
+
+def send_frame(writer, body):
+    writer.write(LENGTH.pack(len(body)) + body)
+
+
+async def read_frame(reader):
+    # None once the other end has gone away
+    try:
+        length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+        return await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+class SharedBoard:
+    # a (width, height, 3) uint8 board in shared memory, plus a version the owner bumps after every change.
+    # A worker reading while the owner writes can see part of the change; the broadcast for that
+    # change is published after the write, so its clients still end up with the whole thing.
+    HEADER = struct.Struct('<QHH') # version, width, height
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        version, self.width, self.height = self.HEADER.unpack_from(shm.buf)
+        self._version = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf)
+        self.pixels = np.ndarray((self.width, self.height, 3), dtype=np.uint8, buffer=shm.buf, offset=self.HEADER.size)
+
+    @classmethod
+    def create(cls, width, height):
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER.size + width * height * 3)
+        cls.HEADER.pack_into(shm.buf, 0, 0, width, height)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # the owner unlinks it; without this our resource tracker would too, as soon as we exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def version(self):
+        return int(self._version[0])
+
+    def bump(self):
+        self._version[0] += 1
+
+    def close(self):
+        # the arrays are views into the segment and have to go before it can be closed
+        self._version = self.pixels = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # a FrameBuffer still holds a view; the mapping goes when the process does
+        if self.owner:
+            self.shm.unlink()
+
+
+class WorkerLink:
+    # what a ClientOutbox sends to: a worker's end of the hub socket
+    def __init__(self, writer):
+        self.writer = writer
+
+    async def send(self, body):
+        send_frame(self.writer, body)
+        await self.writer.drain() # only waits once the transport's buffer is over its high-water mark
+
+    async def close(self, code=None):
+        self.writer.close()
+
+
+class Hub:
+    # the owner's end: a Unix socket server every worker connects to
+    def __init__(self, path, on_message, on_board, queue_size=4096):
+        self.path = path
+        self.on_message = on_message # async, called with a client message str or bytes
+        self.on_board = on_board     # async, called with width, height, fade, rgb
+        self.queue_size = queue_size # publishes buffered per worker before coalescing
+        self.workers = {} # writer -> ClientOutbox of publishes for that worker
+        self.handlers = set() # one task per worker connection
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def _serve(self, reader, writer):
+        outbox = self.workers[writer] = ClientOutbox(WorkerLink(writer), maxsize=self.queue_size, policy="coalesce")
+        sender = asyncio.ensure_future(outbox.run())
+        self.handlers.add(asyncio.current_task())
+        try:
+            while True:
+                body = await read_frame(reader)
+                if body is None:
+                    break
+                try:
+                    op = body[0]
+                    if op == OP_PUBLISH:
+                        self._send(body, publish_key(body)) # relay a worker's broadcast to everyone, that worker included
+                    elif op == OP_MESSAGE:
+                        await self.on_message(decode_message(body))
+                    elif op == OP_BOARD:
+                        await self.on_board(*decode_board(body))
+                    else:
+                        raise HubError(f"Unknown hub op {op:#x}.")
+                except Exception as ex: # one bad message shouldn't cut a worker off
+                    print(f"hub: {ex}")
+        finally:
+            self.workers.pop(writer, None)
+            self.handlers.discard(asyncio.current_task())
+            outbox.close()
+            await asyncio.gather(sender, return_exceptions=True) # a worker that went away fails its last drain()
+            writer.close()
+
+    def _send(self, body, key=None):
+        for outbox in list(self.workers.values()):
+            outbox.put(body, key)
+
+    def publish(self, text, binary=None, key=None):
+        if self.workers:
+            self._send(encode_publish(text, binary, key), key)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for writer in list(self.workers):
+            writer.transport.abort() # each handler sees the end of its stream and returns; nothing waits on a stalled worker's buffer
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+
+class HubClient:
+    # a worker's end of the hub
+    def __init__(self, path, on_publish):
+        self.path = path
+        self.on_publish = on_publish # called with text, binary, key for every broadcast
+        self.reader = self.writer = None
+        self.closed = asyncio.Event() # set when the owner goes away; the worker shuts down
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+
+    async def run(self):
+        try:
+            while True:
+                body = await read_frame(self.reader)
+                if body is None:
+                    break
+                if body[0] == OP_PUBLISH:
+                    self.on_publish(*decode_publish(body))
+        finally:
+            self.closed.set()
+
+    def publish(self, text, binary=None, key=None):
+        send_frame(self.writer, encode_publish(text, binary, key))
+
+    def send_message(self, data):
+        send_frame(self.writer, encode_message(data))
+
+    def send_board(self, width, height, fade, rgb):
+        send_frame(self.writer, encode_board(width, height, fade, rgb))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# How the LED strip is wired across the wall.
+# A Layout maps every board position (x, y), with 0,0 in the lower left, to its position on
+# the strip.  index is a (width, height) array of strip positions (-1 where a panel leaves
+# a hole); forward is the same thing flattened x-major like FrameBuffer.tobytes(), and
+# inverse gives, for every LED on the strip, the flat board position it shows (-1 if
+# none).  Moving a whole frame between board and strip order is a single gather.
+#
+# Wiring can be built in code, described by a short spec on the command line
+# ("serpentine", "progressive:lower-left", "serpentine:lower-right:90"), or loaded from a
+# JSON file, either as a list of panels:
+#   {"panels": [{"wiring": "serpentine", "width": 10, "height": 20, "start": "lower-right",
+#                "rotate": 0, "x": 0, "y": 0}, ...]}
+# or as an explicit map, one [x, y] (or null) per LED in strip order:
+#   {"width": 10, "height": 20, "leds": [[9, 0], [8, 0], ...]}
+
+import json
+
+import numpy as np
+
+WIRINGS = ("serpentine", "progressive")
+STARTS = ("lower-right", "lower-left", "upper-right", "upper-left")
+
+
+class LayoutError(ValueError):
+    pass
+
+
+class Layout:
+    def __init__(self, index, count=None):
+        # index[x, y] is the strip position of that pixel, or -1 for no LED there
+        self.index = np.array(index, dtype=np.intp)
+        if self.index.ndim != 2:
+            raise LayoutError("Layout index must be a (width, height) grid.")
+        self.width, self.height = self.index.shape
+        self.forward = self.index.reshape(-1)
+        mapped = self.forward >= 0
+        if len(np.unique(self.forward[mapped])) != np.count_nonzero(mapped):
+            raise LayoutError("Two board positions share an LED.")
+        self.count = max(count or 0, int(self.forward.max()) + 1 if mapped.any() else 0)
+        self.inverse = np.full(self.count, -1, dtype=np.intp)
+        self.inverse[self.forward[mapped]] = np.flatnonzero(mapped)
+        # the common case, every LED on the board and every board position on an LED, is one plain gather
+        self.dense = bool(mapped.all()) and self.count == len(self.forward)
+        self._board_cells = np.flatnonzero(mapped)
+        self._strip_cells = self.forward[mapped]
+
+    @classmethod
+    def grid(cls, width, height, wiring="serpentine", start="lower-right"):
+        # rows of width LEDs stacked height high, starting in the given corner
+        if wiring not in WIRINGS:
+            raise LayoutError(f"Unknown wiring '{wiring}', expected one of {', '.join(WIRINGS)}.")
+        if start not in STARTS:
+            raise LayoutError(f"Unknown start corner '{start}', expected one of {', '.join(STARTS)}.")
+        x = np.arange(width)[:, None]
+        y = np.arange(height)[None, :]
+        row = y if start.startswith("lower") else height - 1 - y
+        reverse = np.broadcast_to(start.endswith("right"), row.shape)
+        if wiring == "serpentine": # account for wire snaking back and forth
+            reverse = reverse ^ (row % 2 == 1)
+        column = np.where(reverse, width - 1 - x, x)
+        return cls(row * width + column)
+
+    @classmethod
+    def from_pgrid(cls, pgrid):
+        # the nested [x][y] lists the scripts used to build by hand
+        return cls(pgrid)
+
+    @classmethod
+    def panels(cls, panels):
+        # [(layout, x, y), ...] chained in strip order, each placed with its lower-left corner at x, y
+        width = max(x + layout.width for layout, x, y in panels)
+        height = max(y + layout.height for layout, x, y in panels)
+        index = np.full((width, height), -1, dtype=np.intp)
+        offset = 0
+        for layout, x, y in panels:
+            region = index[x:x + layout.width, y:y + layout.height]
+            if (region[layout.index >= 0] >= 0).any():
+                raise LayoutError(f"Panel at {x},{y} overlaps another panel.")
+            region[layout.index >= 0] = layout.index[layout.index >= 0] + offset
+            offset += layout.count
+        return cls(index, offset)
+
+    @classmethod
+    def from_map(cls, width, height, leds):
+        # leds[n] is the [x, y] LED n shows, or None for an LED that isn't on the board
+        index = np.full((width, height), -1, dtype=np.intp)
+        for n, position in enumerate(leds):
+            if position is None:
+                continue
+            x, y = position
+            if not (0 <= x < width and 0 <= y < height):
+                raise LayoutError(f"LED {n} is mapped off the board at {x},{y}.")
+            if index[x, y] >= 0:
+                raise LayoutError(f"LEDs {index[x, y]} and {n} are both mapped to {x},{y}.")
+            index[x, y] = n
+        return cls(index, len(leds))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            spec = json.load(fp)
+        if "leds" in spec:
+            return cls.from_map(spec["width"], spec["height"], spec["leds"])
+        panels = []
+        for panel in spec.get("panels", [spec]):
+            layout = cls.grid(panel["width"], panel["height"], panel.get("wiring", "serpentine"), panel.get("start", "lower-right"))
+            panels.append((layout.rotated(panel.get("rotate", 0)), panel.get("x", 0), panel.get("y", 0)))
+        return cls.panels(panels)
+
+    @classmethod
+    def from_spec(cls, spec, pixel_count, row_length):
+        # --layout on the command line: a JSON file, or wiring[:start[:degrees]] for a width of row_length
+        if spec and spec.endswith(".json"):
+            return cls.load(spec)
+        wiring, start, degrees = ((spec or "serpentine").split(":") + ["lower-right", "0"])[:3]
+        try:
+            degrees = int(degrees)
+        except ValueError:
+            raise LayoutError(f"Rotation '{degrees}' isn't a whole number of degrees.")
+        width, height = row_length, pixel_count // row_length
+        if degrees % 180: # wire it the other way round, then turn it to fit the board
+            width, height = height, width
+        return cls.grid(width, height, wiring, start).rotated(degrees)
+
+    def rotated(self, degrees):
+        # the same wiring turned counterclockwise in 90 degree steps
+        if degrees % 90:
+            raise LayoutError("Layouts only rotate in steps of 90 degrees.")
+        return Layout(np.rot90(self.index, (degrees // 90) % 4), self.count)
+
+    @property
+    def pgrid(self):
+        return self.index.tolist()
+
+    def positions(self, points):
+        # strip positions of a list of [x, y] points, looked up together
+        points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+        return self.index[points[:, 0], points[:, 1]].tolist()
+
+    def to_strip(self, pixels, count=None):
+        # (width, height, 3) board pixels to a (count, 3) strip; LEDs with no board position stay dark
+        board = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+        if count is None:
+            count = self.count
+        if self.dense and count == self.count:
+            return board[self.inverse]
+        strip = np.zeros((count, 3), dtype=np.uint8)
+        keep = self._strip_cells < count
+        strip[self._strip_cells[keep]] = board[self._board_cells[keep]]
+        return strip
+
+    def from_strip(self, strip):
+        # a strip frame (bytes or an (n, 3) array) back to (width, height, 3) board pixels
+        if isinstance(strip, (bytes, bytearray, memoryview)):
+            strip = np.frombuffer(strip, dtype=np.uint8)
+        strip = np.asarray(strip, dtype=np.uint8).reshape(-1, 3)
+        if self.dense and len(strip) >= self.count:
+            return strip[self.forward].reshape(self.width, self.height, 3)
+        board = np.zeros((self.width * self.height, 3), dtype=np.uint8)
+        keep = self._strip_cells < len(strip)
+        board[self._board_cells[keep]] = strip[self._strip_cells[keep]]
+        return board.reshape(self.width, self.height, 3)
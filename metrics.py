@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Runtime metrics for the web server, served at /metrics in the Prometheus text format.
+# Counters, gauges and histograms here are a dict update or a bisect and a list
+# increment, cheap enough to leave on for every message and every show().  Nothing is
+# formatted until something scrapes /metrics.  Counters and gauges can take a read()
+# callback, so values like the number of connected sockets are sampled at scrape time
+# instead of being kept up to date on the hot path.
+#
+# There are no locks: everything is updated and scraped on the event loop.  Time work
+# done on other threads there and observe the result back on the loop, the way
+# render.RenderLoop does for show().
+
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; covers a websocket hop through to a 5000 pixel strip at a slow SPI clock
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=(), read=None):
+        # read() is called at scrape time instead of keeping the value up to date; it returns
+        # the value, or with labels a {labelvalues: value} dict
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.read = read
+
+    def samples(self):
+        # [(suffix, labelvalues, extra labels, value), ...]
+        values = self.values
+        if self.read is not None:
+            values = self.read()
+            if not self.labelnames:
+                values = {(): values}
+        return [("", labelvalues, (), value) for labelvalues, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, values, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labelvalues):
+        self.values[labelvalues] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {} # labelvalues -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value, *labelvalues):
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self):
+        samples = []
+        for values, counts in sorted(self.series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                samples.append(("_bucket", values, (("le", format_value(float(bound))),), total))
+            samples.append(("_sum", values, (), counts[-1]))
+            samples.append(("_count", values, (), total))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=(), read=None):
+        return self.add(Counter(name, help, labelnames, read))
+
+    def gauge(self, name, help, labelnames=(), read=None):
+        return self.add(Gauge(name, help, labelnames, read))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+async def watch_loop_lag(histogram, gauge=None, interval=0.5):
+    # how late the event loop wakes a task that asked to sleep for interval; a busy loop shows up here first
+    loop = asyncio.get_running_loop()
+    while True:
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - due)
+        histogram.observe(lag)
+        if gauge is not None:
+            gauge.set(lag)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# LED output devices.
+# show() on one WS2801 chain clocks every pixel out over SPI, so a single long chain gets
+# slower the bigger the wall.  MultiBusOutput looks like one WS2801Pixels strip to the
+# rest of the code but splits it across several chains (one SPI controller each), with a
+# writer thread per chain so every chain clocks out the same frame at the same time.
+# WS2801 has no chip select: every strip wired to a controller's SCLK/MOSI takes every
+# frame clocked out on it, so two chains can't share a port (e.g. 0.0 and 0.1 on SPI0).
+#
+# open_device() builds whatever the command line asked for:
+#   --chains 0.0:200,1.0:200   two chains on SPI0 and SPI1 (/dev/spidev0.0 and /dev/spidev1.0,
+#                              SPI1 needs dtoverlay=spi1-1cs on a Pi), 200 pixels each
+#   --virtual                  simulated strips (see virtual.py) instead of SPI hardware
+#   --spi-hz 1000000           SPI clock, real or simulated
+#   --record out.wpa           with --virtual, keep every shown frame in a file
+
+import atexit
+import threading
+import time
+from pathlib import Path
+
+from framebuffer import write_strip
+from virtual import VirtualWS2801, DEFAULT_SPI_HZ
+
+
+class ChainWriter(threading.Thread):
+    # pushes one chain's frames; each show() gets timed
+    def __init__(self, name, device):
+        super().__init__(name=f"chain-{name}", daemon=True)
+        self.chain = name
+        self.device = device
+        self.go = threading.Event()
+        self.done = threading.Event()
+        self.stopping = False
+        self.error = None
+        self.frames = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.max = 0.0
+
+    def run(self):
+        while True:
+            self.go.wait()
+            self.go.clear()
+            if self.stopping:
+                return
+            started = time.perf_counter()
+            try:
+                self.device.show()
+            except Exception as ex:
+                self.error = ex
+            self.last = time.perf_counter() - started
+            self.total += self.last
+            self.max = max(self.max, self.last)
+            self.frames += 1
+            self.done.set()
+
+    def stats(self):
+        return {
+            "chain": self.chain,
+            "pixels": self.device.count(),
+            "frames": self.frames,
+            "last_ms": round(self.last * 1000, 3),
+            "avg_ms": round(self.total / self.frames * 1000, 3) if self.frames else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class MultiBusOutput:
+    # one logical strip made of several chains laid end to end, in the order given
+    def __init__(self, chains):
+        # chains is [(name, device), ...], each device a WS2801Pixels-like strip
+        if not chains:
+            raise ValueError("MultiBusOutput needs at least one chain.")
+        self.writers = []
+        self.spans = [] # (start, end) pixel range of each chain in the logical strip
+        start = 0
+        for name, device in chains:
+            end = start + device.count()
+            self.writers.append(ChainWriter(name, device))
+            self.spans.append((start, end))
+            start = end
+        self._count = start
+        self._pixels = bytearray(self._count * 3) # framebuffer.write_strip() fills this in one copy
+        self.frames = 0
+        self.last = 0.0
+        for writer in self.writers:
+            writer.start()
+
+    def count(self):
+        return self._count
+
+    def set_pixel(self, n, color):
+        self._pixels[n * 3:n * 3 + 3] = bytes(((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF))
+
+    def set_pixel_rgb(self, n, r, g, b):
+        self._pixels[n * 3:n * 3 + 3] = bytes((r, g, b))
+
+    def set_pixels(self, color):
+        for n in range(self._count):
+            self.set_pixel(n, color)
+
+    def get_pixel(self, n):
+        r, g, b = self.get_pixel_rgb(n)
+        return (r << 16) | (g << 8) | b
+
+    def get_pixel_rgb(self, n):
+        return tuple(self._pixels[n * 3:n * 3 + 3])
+
+    def clear(self):
+        self._pixels[:] = bytes(len(self._pixels))
+
+    def show(self):
+        # hand every chain its slice, start them all, and wait for the slowest
+        started = time.perf_counter()
+        view = memoryview(self._pixels)
+        for writer, (start, end) in zip(self.writers, self.spans):
+            write_strip(writer.device, view[start * 3:end * 3])
+            writer.done.clear()
+            writer.go.set()
+        for writer in self.writers:
+            writer.done.wait()
+        self.last = time.perf_counter() - started
+        self.frames += 1
+        for writer in self.writers:
+            if writer.error is not None:
+                error, writer.error = writer.error, None
+                raise error
+
+    def chain_stats(self):
+        # per-chain show() timing; the frame takes as long as the slowest chain
+        return [writer.stats() for writer in self.writers]
+
+    def close(self):
+        for writer in self.writers:
+            writer.stopping = True
+            writer.go.set()
+        for writer in self.writers:
+            writer.join()
+            if hasattr(writer.device, "close"):
+                writer.device.close()
+
+
+def parse_chains(spec):
+    # "0.0:200,1.0:200" -> [(0, 0, 200), (1, 0, 200)]
+    chains = []
+    for part in spec.split(","):
+        try:
+            bus, count = part.strip().split(":")
+            port, device = bus.split(".")
+            chains.append((int(port), int(device), int(count)))
+        except ValueError:
+            raise ValueError(f"Bad chain '{part}', expected port.device:pixels like 0.0:200.")
+        if any(other[0] == chains[-1][0] for other in chains[:-1]):
+            # another chip select on the same SCLK/MOSI; its strip would get the other chain's frames too
+            raise ValueError(f"Chain '{part.strip()}' is on SPI port {chains[-1][0]} with another chain; each chain needs its own port.")
+    return chains
+
+
+def open_device(args, ws2801, spi, gpio):
+    # the scripts pass in the Adafruit modules they imported; None means they aren't installed,
+    # and then we're off the Pi and simulate the strip just as --virtual would
+    virtual = getattr(args, "virtual", False) or ws2801 is None
+    spi_hz = getattr(args, "spi_hz", None) or DEFAULT_SPI_HZ
+    record = getattr(args, "record", None)
+
+    def chain(port, device, count, record):
+        if virtual:
+            return VirtualWS2801(count, spi_hz=spi_hz, record=record)
+        pixels = ws2801.WS2801Pixels(count, spi=spi.SpiDev(port, device, max_speed_hz=spi_hz), gpio=gpio)
+        pixels._spi.set_clock_hz(spi_hz) # WS2801Pixels sets its own 1MHz clock over max_speed_hz
+        return pixels
+
+    if getattr(args, "chains", None):
+        chains = []
+        for port, device, count in parse_chains(args.chains):
+            chain_record = str(Path(record).with_suffix(f".{port}.{device}.wpa")) if record else None
+            chains.append((f"{port}.{device}", chain(port, device, count, chain_record)))
+        pixels = MultiBusOutput(chains)
+    else:
+        # Alternatively specify a hardware SPI connection on /dev/spidev0.0:
+        pixels = chain(0, 0, args.pixels, record)
+    if hasattr(pixels, "close"):
+        atexit.register(pixels.close) # finish recordings and stop chain threads however the script ends
+    return pixels
+
+
+def device_stats(pixels):
+    # timing for --chains and --virtual outputs; None for a plain hardware strip
+    if hasattr(pixels, "chain_stats"):
+        stats = pixels.chain_stats()
+        for chain, writer in zip(stats, pixels.writers):
+            if hasattr(writer.device, "stats"):
+                chain["device"] = writer.device.stats()
+        return stats
+    if hasattr(pixels, "stats"):
+        return pixels.stats()
+    return None
@@ -1,32 +1,257 @@
-import sqlite3
+import os
 import pickle
+import re
+import sqlite3
+import struct
+import threading
+
+import numpy as np
+
+import delta
 
 DEFAULT_TABLE = "anim1"
 DEFAULT_DB = "./db.sqlite3"
+DEFAULT_KEYFRAME_INTERVAL = 30
+TABLE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# one connection per (process, database file), opened in WAL mode and reused;
+# each comes with a lock because stores on different threads share it
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _open(db):
+    key = (os.getpid(), os.path.abspath(db))
+    with _connections_lock:
+        if key not in _connections:
+            conn = sqlite3.connect(db, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # WAL keeps this crash-safe; skips an fsync per commit
+            _connections[key] = (conn, threading.RLock())
+        return _connections[key]
+
+
+def connect(db=DEFAULT_DB):
+    return _open(db)[0]
+
 
 def create_anim_table(db=DEFAULT_DB, table_name=DEFAULT_TABLE):
     db.execute(
         f"CREATE TABLE IF NOT EXISTS {table_name} (frame INTEGER PRIMARY KEY NOT NULL, data BINARY NOT NULL)"
     )
 
-def save_frame(db=DEFAULT_DB, frame=0, pixels=[], table_name=DEFAULT_TABLE):
-    db = sqlite3.connect(db)
-    create_anim_table(db, table_name)
-    pickled_data = pickle.dumps(pixels, protocol=pickle.HIGHEST_PROTOCOL)
-    print(f"INSERT OR REPLACE INTO {table_name} (frame, data) VALUES ({frame}, {pickled_data})")
-    res = db.execute(
-        f"INSERT OR REPLACE INTO {table_name} (frame, data) VALUES (?, ?)",
-        (frame, pickled_data),
+
+def create_delta_table(db=DEFAULT_DB, table_name=DEFAULT_TABLE):
+    db.execute(
+        f"CREATE TABLE IF NOT EXISTS {table_name} (frame INTEGER PRIMARY KEY NOT NULL, keyframe INTEGER NOT NULL, data BINARY NOT NULL)"
     )
-    db.commit()  # Remember to commit changes after saving things.
-    db.close()
-    return res
+
+
+def table_columns(db, table_name):
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table_name})")]
+
+
+class FrameStore:
+    # frames of one animation table, sharing the process-wide connection
+    def __init__(self, db=DEFAULT_DB, table_name=DEFAULT_TABLE):
+        if not TABLE_NAME_PATTERN.match(table_name):
+            raise ValueError(f"Bad table name '{table_name}'.")
+        self.table_name = table_name
+        self.db, self.lock = _open(db)
+        with self.lock, self.db:
+            self.create_table()
+
+    def create_table(self):
+        create_anim_table(self.db, self.table_name)
+
+    @staticmethod
+    def encode(pixels):
+        return pickle.dumps(pixels, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode(data):
+        return pickle.loads(data)
+
+    def save_frame(self, frame, pixels):
+        self.save_frames([pixels], start=frame)
+
+    def save_frames(self, frames, start=0):
+        # many frames, numbered from start, in a single transaction
+        rows = ((start + i, self.encode(pixels)) for i, pixels in enumerate(frames))
+        with self.lock, self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO {self.table_name} (frame, data) VALUES (?, ?)", rows
+            )
+
+    def load_frame(self, frame):
+        with self.lock:
+            row = self.db.execute(f"SELECT data FROM {self.table_name} WHERE frame = ?", (frame,)).fetchone()
+        if not row:
+            raise KeyError(frame)
+        return self.decode(row[0])
+
+    def load_range(self, first, last):
+        # [(frame, pixels), ...] for first <= frame <= last, in order
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT frame, data FROM {self.table_name} WHERE frame BETWEEN ? AND ? ORDER BY frame",
+                (first, last),
+            ).fetchall()
+        return [(frame, self.decode(data)) for frame, data in rows]
+
+    def iter_frames(self, first=0, last=None, batch=64):
+        # stream (frame, pixels) in order, fetching batch rows per query so playback never holds the whole table
+        next_frame = first
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT frame, data FROM {self.table_name} WHERE frame >= ? AND frame <= ? ORDER BY frame LIMIT ?",
+                    (next_frame, last if last is not None else (1 << 62), batch),
+                ).fetchall()
+            if not rows:
+                return
+            for frame, data in rows:
+                yield frame, self.decode(data)
+            next_frame = rows[-1][0] + 1
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+
+    def last_frame(self):
+        with self.lock:
+            return self.db.execute(f"SELECT MAX(frame) FROM {self.table_name}").fetchone()[0]
+
+
+class DeltaFrameStore(FrameStore):
+    # same API as FrameStore, but rows hold delta.py payloads against the frame before,
+    # with a keyframe every keyframe_interval frames; storage grows with motion, not board size
+    SHAPE = struct.Struct('<B') # ndim, then that many u16 dimensions, then the payload
+
+    def __init__(self, db=DEFAULT_DB, table_name=DEFAULT_TABLE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1.")
+        self.keyframe_interval = keyframe_interval
+        super().__init__(db, table_name)
+
+    def create_table(self):
+        create_delta_table(self.db, self.table_name)
+        if "keyframe" not in table_columns(self.db, self.table_name):
+            raise ValueError(f"Table '{self.table_name}' holds full frames, not deltas.")
+
+    @classmethod
+    def pack(cls, shape, payload):
+        return cls.SHAPE.pack(len(shape)) + struct.pack(f'<{len(shape)}H', *shape) + payload
+
+    @classmethod
+    def unpack(cls, data):
+        ndim, = cls.SHAPE.unpack_from(data)
+        shape = struct.unpack_from(f'<{ndim}H', data, cls.SHAPE.size)
+        return shape, memoryview(data)[cls.SHAPE.size + 2 * ndim:]
+
+    @staticmethod
+    def to_pixels(shape, raw):
+        return np.frombuffer(bytes(raw), dtype=np.uint8).reshape(shape).tolist()
+
+    def _rows_from_keyframe(self, frame, last, batch):
+        # (frame, data) rows starting at the keyframe at or before frame
+        with self.lock:
+            key = self.db.execute(
+                f"SELECT MAX(frame) FROM {self.table_name} WHERE frame <= ? AND keyframe = 1", (frame,)
+            ).fetchone()[0]
+        next_frame = key if key is not None else frame
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT frame, data FROM {self.table_name} WHERE frame >= ? AND frame <= ? ORDER BY frame LIMIT ?",
+                    (next_frame, last, batch),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            next_frame = rows[-1][0] + 1
+
+    def _decode_at(self, frame):
+        # (shape, raw bytes) of one frame, replayed from its keyframe; None if it isn't stored
+        shape = raw = None
+        for number, data in self._rows_from_keyframe(frame, frame, self.keyframe_interval):
+            shape, payload = self.unpack(data)
+            raw = delta.apply_delta(raw, payload)
+            if number == frame:
+                return shape, raw
+        return None
+
+    def save_frames(self, frames, start=0):
+        with self.lock, self.db:
+            prev = self._decode_at(start - 1) if start > 0 else None
+            rows = []
+            for i, pixels in enumerate(frames):
+                pixels = np.asarray(pixels, dtype=np.uint8)
+                raw = pixels.tobytes()
+                if prev is None or prev[0] != pixels.shape or (start + i) % self.keyframe_interval == 0:
+                    payload = delta.encode_keyframe(raw)
+                else:
+                    payload = delta.encode_delta(prev[1], raw)
+                rows.append((start + i, int(delta.is_keyframe(payload)), self.pack(pixels.shape, payload)))
+                prev = (pixels.shape, raw)
+            # the frame after this batch was a delta against what we just replaced; make it stand alone
+            end = start + len(rows)
+            following = self.db.execute(f"SELECT keyframe FROM {self.table_name} WHERE frame = ?", (end,)).fetchone()
+            if rows and following is not None and not following[0]:
+                shape, raw = self._decode_at(end)
+                rows.append((end, 1, self.pack(shape, delta.encode_keyframe(raw))))
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO {self.table_name} (frame, keyframe, data) VALUES (?, ?, ?)", rows
+            )
+
+    def load_frame(self, frame):
+        decoded = self._decode_at(frame)
+        if decoded is None:
+            raise KeyError(frame)
+        return self.to_pixels(*decoded)
+
+    def load_range(self, first, last):
+        return list(self.iter_frames(first, last))
+
+    def iter_frames(self, first=0, last=None, batch=64):
+        raw = None
+        for frame, data in self._rows_from_keyframe(first, last if last is not None else (1 << 62), batch):
+            shape, payload = self.unpack(data)
+            raw = delta.apply_delta(raw, payload)
+            if frame >= first:
+                yield frame, self.to_pixels(shape, raw)
+
+
+def open_store(db=DEFAULT_DB, table_name=DEFAULT_TABLE):
+    # whichever kind of store an existing table was written as; new tables are plain
+    conn, lock = _open(db)
+    with lock:
+        columns = table_columns(conn, table_name) if TABLE_NAME_PATTERN.match(table_name) else []
+    return DeltaFrameStore(db, table_name) if "keyframe" in columns else FrameStore(db, table_name)
+
+
+_stores = {}
+
+
+def get_store(db=DEFAULT_DB, table_name=DEFAULT_TABLE):
+    # stores are cheap but their table checks aren't; keep one per table, of whichever kind open_store() finds
+    key = (os.getpid(), os.path.abspath(db), table_name)
+    with _connections_lock:
+        store = _stores.get(key)
+    if store is None:
+        store = open_store(db, table_name) # a delta table gets a DeltaFrameStore
+        with _connections_lock:
+            store = _stores.setdefault(key, store)
+    return store
+
+
+def save_frame(db=DEFAULT_DB, frame=0, pixels=[], table_name=DEFAULT_TABLE):
+    get_store(db, table_name).save_frame(frame, pixels)
+
+
+def save_frames(db=DEFAULT_DB, frames=[], start=0, table_name=DEFAULT_TABLE):
+    get_store(db, table_name).save_frames(frames, start)
+
 
 def load_frame(db=DEFAULT_DB, frame=0, table_name=DEFAULT_TABLE):
-    db = sqlite3.connect(db)
-    res = db.execute(f"SELECT data FROM {table_name} WHERE frame = ?", (frame,))
-    row = res.fetchone()
-    db.close()
-    if not row:
-        raise KeyError(frame)
-    return pickle.loads(row[0])
+    return get_store(db, table_name).load_frame(frame)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Drift-free frame playback.
+# Frames are scheduled against a monotonic clock (frame n is due at start + n / fps)
+# instead of sleeping a fixed wait after each show(), so compute and SPI time no longer
+# stretch the animation.  When playback falls more than a frame behind, late frames
+# are dropped until it catches up.  The last frame is always shown, and nothing is
+# dropped while computing or showing a single frame takes longer than a frame period:
+# dropping can't catch up then, it would only skip the animation.  play() returns what actually happened, and
+# with a profiling.FrameProfiler every frame's compute, show and wait time is recorded too.
+
+import statistics
+import time
+
+
+class PlaybackStats:
+    def __init__(self, target_fps):
+        self.target_fps = target_fps
+        self.shown = 0
+        self.dropped = 0
+        self.elapsed = 0.0
+        self.intervals = [] # seconds between consecutive show() calls
+
+    @property
+    def achieved_fps(self):
+        return self.shown / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def jitter_ms(self):
+        # spread of the frame-to-frame interval
+        return statistics.pstdev(self.intervals) * 1000 if len(self.intervals) > 1 else 0.0
+
+    def as_dict(self):
+        return {
+            "target_fps": self.target_fps,
+            "achieved_fps": round(self.achieved_fps, 2),
+            "jitter_ms": round(self.jitter_ms, 3),
+            "shown": self.shown,
+            "dropped": self.dropped,
+            "elapsed": round(self.elapsed, 4),
+        }
+
+    def __str__(self):
+        target = f"{self.target_fps:g}" if self.target_fps else "unpaced"
+        return (f"{self.shown} frames in {self.elapsed:.3f}s: {self.achieved_fps:.1f} fps (target {target}), "
+                f"jitter {self.jitter_ms:.2f} ms, {self.dropped} dropped")
+
+
+class Player:
+    def __init__(self, fps=None, drop_late=True, clock=None, sleep=None, profiler=None):
+        # fps=None plays as fast as frames can be shown
+        # clock and sleep default to time.monotonic and time.sleep, looked up when play() starts so
+        # patched ones (bench.py skips the sleeps) are used
+        if fps is not None and fps <= 0:
+            raise ValueError("fps must be positive.")
+        self.fps = fps
+        self.drop_late = drop_late
+        self.clock = clock
+        self.sleep = sleep
+        self.profiler = profiler
+
+    def play(self, source, show, stop=None, label="play"):
+        # show(frame) pushes one frame; stop() returning True ends playback early
+        # label names these frames in the profile
+        stats = PlaybackStats(self.fps)
+        profiler = self.profiler
+        clock = self.clock or time.monotonic
+        sleep = self.sleep or time.sleep
+        period = 1.0 / self.fps if self.fps else 0.0
+        start = clock()
+        last_shown = None
+        show_seconds = 0.0 # how long the last show() took; nothing is dropped before one has been timed
+        dropped_last = False # whether the last frame pulled was dropped
+        slot = 0
+        frames = iter(source)
+        while True:
+            if profiler is not None:
+                profiler.begin_frame(label)
+            pulled = clock()
+            try:
+                frame = next(frames) # generator sources do their work here
+            except StopIteration:
+                if not dropped_last:
+                    if profiler is not None:
+                        profiler.cancel_frame()
+                    break
+                # the source ended on a dropped frame; show it anyway so the strip ends where the animation does
+                frame = last_frame
+                dropped_last = False
+                stats.dropped -= 1
+                if profiler is not None:
+                    profiler.mark("compute")
+            else:
+                if profiler is not None:
+                    profiler.mark("compute")
+                if stop is not None and stop():
+                    if profiler is not None:
+                        profiler.cancel_frame()
+                    break
+                due = start + slot * period
+                slot += 1
+                now = clock()
+                slow = max(now - pulled, show_seconds) >= period # a frame's compute or show alone takes a whole slot
+                if period and self.drop_late and last_shown is not None and now > due + period and not slow:
+                    stats.dropped += 1 # more than a whole frame late; skip it to catch up
+                    dropped_last, last_frame = True, frame
+                    if profiler is not None:
+                        profiler.end_frame(dropped=True)
+                    continue
+                dropped_last = False
+                if now < due:
+                    sleep(due - now)
+                    if profiler is not None:
+                        profiler.mark("wait")
+            show_started = clock()
+            show(frame)
+            if profiler is not None:
+                profiler.mark("show")
+                profiler.end_frame()
+            shown_at = clock()
+            show_seconds = shown_at - show_started
+            if last_shown is not None:
+                stats.intervals.append(shown_at - last_shown)
+            last_shown = shown_at
+            stats.shown += 1
+        if period: # the last frame gets its full slot too
+            remaining = start + slot * period - clock()
+            if remaining > 0:
+                sleep(remaining)
+        stats.elapsed = clock() - start
+        return stats
+
+
+# frame sources: each yields strip-order RGB frames
+
+def animation_source(anim, loop=False):
+    # an animfile.AnimationFile; frames are zero-copy slices of the mapped file
+    return anim.loop() if loop else iter(anim)
+
+
+def pklite_source(store, width, height, layout=None, first=0, last=None):
+    # a pklite.FrameStore, streamed in frame order
+    from animfile import to_strip
+    for frame, pixels in store.iter_frames(first, last):
+        yield to_strip(pixels, width, height, layout)
+
+
+def saves_source(paths, layout):
+    # a sequence of saved boards, one frame each; saves of another size are cropped or padded to fit
+    import saves
+    from framebuffer import FrameBuffer
+    board = FrameBuffer(layout.width, layout.height, layout)
+    for path in paths:
+        meta, rgb = saves.read_save(path)
+        board.load(FrameBuffer.from_bytes(meta["width"], meta["height"], rgb))
+        yield board.to_strip()
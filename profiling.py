@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Per-frame profiling for effects and the web server's render loop.
+# A frame is timed like a stopwatch with laps: begin_frame() starts it, and each
+# mark(phase) charges the time since the previous mark to that phase.  Player, show_frame()
+# and RenderLoop mark the phases every frame goes through:
+#   compute  working out the next frame (effect math, reading a file, flushing dirty pixels)
+#   write    copying it into the device's pixel buffer (RGB_to_color, set_pixel)
+#   show     clocking it out to the LEDs (SPI)
+#   wait     sleeping until the frame is due
+# Everything goes to a Chrome trace-event file (open it in chrome://tracing or
+# https://ui.perfetto.dev), and summary() lists the slowest frames, leaving out the
+# time they spent waiting their turn, with where their time went.  Frames are tracked
+# per thread, so effects on the animation worker and the render loop can be profiled
+# at the same time.  Nothing here runs unless a profiler is passed in, e.g. with --profile.
+#
+#   python3 profiling.py trace.json    summary of a trace written earlier
+
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+PHASES = ("compute", "write", "show", "wait")
+
+
+class FrameRecord:
+    def __init__(self, label, index, started):
+        self.label = label
+        self.index = index
+        self.started = started
+        self.last = started
+        self.ended = started
+        self.phases = defaultdict(float) # phase -> seconds
+        self.dropped = False
+
+    @property
+    def total(self):
+        return self.ended - self.started
+
+    def as_dict(self):
+        return {
+            "label": self.label,
+            "frame": self.index,
+            "total_ms": round(self.total * 1000, 3),
+            **{f"{phase}_ms": round(seconds * 1000, 3) for phase, seconds in self.phases.items()},
+            **({"dropped": True} if self.dropped else {}),
+        }
+
+
+class FrameProfiler:
+    def __init__(self, max_frames=50000, clock=time.perf_counter):
+        self.max_frames = max_frames # stop recording after this many so a long run can't eat the Pi's memory
+        self.clock = clock
+        self.origin = clock()
+        self.pid = os.getpid()
+        self.events = []
+        self.frames = []
+        self.counts = defaultdict(int) # label -> frames seen
+        self.skipped = 0
+        self.threads = {}
+        self.local = threading.local()
+
+    def _us(self, seconds):
+        return round((seconds - self.origin) * 1e6, 1)
+
+    def _tid(self):
+        ident = threading.get_ident()
+        if ident not in self.threads:
+            self.threads[ident] = threading.current_thread().name
+        return ident
+
+    def begin_frame(self, label):
+        # returns the record, or None once max_frames have been recorded
+        index = self.counts[label]
+        self.counts[label] += 1
+        if len(self.frames) >= self.max_frames:
+            self.skipped += 1
+            self.local.frame = None
+            return None
+        record = FrameRecord(label, index, self.clock())
+        self.local.frame = record
+        return record
+
+    def mark(self, phase):
+        # charge the time since the last mark in this thread's frame to phase
+        record = getattr(self.local, "frame", None)
+        if record is None:
+            return
+        now = self.clock()
+        if now > record.last:
+            record.phases[phase] += now - record.last
+            self.events.append({"name": phase, "cat": record.label, "ph": "X", "ts": self._us(record.last),
+                                "dur": round((now - record.last) * 1e6, 1), "pid": self.pid, "tid": self._tid()})
+        record.last = now
+
+    def end_frame(self, dropped=False):
+        record = getattr(self.local, "frame", None)
+        if record is None:
+            return
+        self.local.frame = None
+        record.ended = record.last
+        record.dropped = dropped
+        self.frames.append(record)
+        self.events.append({"name": f"{record.label} #{record.index}", "cat": "frame", "ph": "X",
+                            "ts": self._us(record.started), "dur": round(record.total * 1e6, 1),
+                            "pid": self.pid, "tid": self._tid(), "args": record.as_dict()})
+
+    def cancel_frame(self):
+        # the frame never happened, e.g. the source ran out
+        record = getattr(self.local, "frame", None)
+        if record is not None:
+            self.counts[record.label] -= 1
+        self.local.frame = None
+
+    def trace(self):
+        names = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": ident, "args": {"name": name}}
+                 for ident, name in self.threads.items()]
+        return {"traceEvents": names + self.events, "displayTimeUnit": "ms",
+                "otherData": {"frames": len(self.frames), "skipped": self.skipped}}
+
+    def write(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.trace(), fp)
+
+    def summary(self, slowest=10):
+        return summarize([record.as_dict() for record in self.frames], slowest, self.skipped)
+
+
+def open_profile(path, slowest=10):
+    # for a --profile flag: a profiler whose trace is written, and summary printed, when the program exits
+    profiler = FrameProfiler()
+
+    def finish():
+        profiler.write(path)
+        print(profiler.summary(slowest))
+        print(f"trace written to {path}")
+
+    atexit.register(finish)
+    return profiler
+
+
+def busy_ms(frame):
+    # the frame's time minus its scheduled wait; what makes an effect choppy
+    return frame["total_ms"] - frame.get("wait_ms", 0.0)
+
+
+def summarize(frames, slowest=10, skipped=0):
+    # frames are FrameRecord.as_dict()s; per-label phase averages, then the busiest frames
+    if not frames:
+        return "no frames profiled"
+    lines = [f"{len(frames)} frames profiled" + (f", {skipped} more not recorded" if skipped else "")]
+    columns = [f"{phase}_ms" for phase in PHASES]
+    by_label = defaultdict(list)
+    for frame in frames:
+        by_label[frame["label"]].append(frame)
+    lines.append(f"{'label':<28}{'frames':>8}{'busy ms':>10}{'max busy':>10}" + "".join(f"{phase:>10}" for phase in PHASES))
+    for label, group in sorted(by_label.items(), key=lambda item: -sum(busy_ms(frame) for frame in item[1])):
+        mean = sum(busy_ms(frame) for frame in group) / len(group)
+        worst = max(busy_ms(frame) for frame in group)
+        phases = "".join(f"{sum(frame.get(column, 0.0) for frame in group) / len(group):>10.3f}" for column in columns)
+        lines.append(f"{label:<28}{len(group):>8}{mean:>10.3f}{worst:>10.3f}{phases}")
+    lines.append(f"slowest {min(slowest, len(frames))} frames, not counting their wait:")
+    for frame in sorted(frames, key=busy_ms, reverse=True)[:slowest]:
+        where = ", ".join(f"{column[:-3]} {frame[column]:.3f}" for column in columns if frame.get(column))
+        lines.append(f"  {frame['label']} #{frame['frame']}: {busy_ms(frame):.3f} ms ({where})" + (" dropped" if frame.get("dropped") else ""))
+    return "\n".join(lines)
+
+
+def load_trace(path):
+    # the per-frame records back out of a trace written by FrameProfiler.write()
+    with open(path) as fp:
+        trace = json.load(fp)
+    frames = [event["args"] for event in trace["traceEvents"] if event.get("cat") == "frame"]
+    return frames, trace.get("otherData", {}).get("skipped", 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a frame profile written with --profile")
+    parser.add_argument("trace")
+    parser.add_argument("-n", "--slowest", type=int, default=10, help="how many of the slowest frames to list (default=10)")
+    args = parser.parse_args()
+    frames, skipped = load_trace(args.trace)
+    print(summarize(frames, args.slowest, skipped))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Fixed-rate render loop for the web server.
+# The render task is the only thing that touches the WS2801 device: handlers write
+# into the shared framebuffer and mark pixels dirty, and the loop pushes all of the
+# accumulated changes with a single show() at most once per tick.
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from framebuffer import write_strip
+
+
+class RenderLoop:
+    def __init__(self, device, frame, max_fps=30):
+        if max_fps <= 0:
+            raise ValueError("max_fps must be positive.")
+        self.device = device
+        self.frame = frame        # FrameBuffer shared with the websocket handlers
+        self.period = 1.0 / max_fps
+        self.dirty = set()        # (x, y) changed since the last flush
+        self.full = False         # the whole frame needs pushing, e.g. after a clear
+        self.strip = None         # whole strip-order RGB frame waiting to go out, e.g. from an animation
+        self.wake = asyncio.Event()
+        self.frames = 0
+        self.show_seconds = None  # optional metrics.Histogram of show() durations
+        self.last_show = 0.0      # seconds the last show() took
+        self.profiler = None      # optional profiling.FrameProfiler; frames are labelled "render"
+        # show() clocks the whole strip out over SPI; keep it off the event loop
+        self.spi = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+
+    def mark(self, x, y):
+        self.dirty.add((x, y))
+        self.wake.set()
+
+    def mark_all(self):
+        self.full = True
+        self.wake.set()
+
+    def show_strip(self, frame):
+        # frame is strip-order RGB bytes; only the newest one matters if several arrive in a tick
+        self.strip = frame
+        self.wake.set()
+
+    @property
+    def pending(self):
+        return self.full or bool(self.dirty) or self.strip is not None
+
+    def flush(self):
+        # copy pending changes into the device buffer; returns how many pixels were written
+        written = 0
+        strip, self.strip = self.strip, None
+        if strip is not None:
+            write_strip(self.device, strip)
+            written += len(strip) // 3
+        dirty, self.dirty = self.dirty, set()
+        if self.full:
+            self.full = False
+            self.frame.write_to(self.device) # one reorder for the whole board
+            return written + self.frame.width * self.frame.height
+        for x, y in dirty:
+            n = int(self.frame.strip_index[x, y])
+            if n < 0:
+                continue # a hole between panels; nothing to light
+            r, g, b = self.frame.pixels[x, y].tolist()
+            self.device.set_pixel(n, (r << 16) | (g << 8) | b)
+        return written + len(dirty)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self.wake.clear()
+                await self.wake.wait() # nothing changed; sleep until somebody paints
+            started = loop.time()
+            profiler = self.profiler
+            if profiler is not None:
+                profiler.begin_frame("render")
+            self.flush()
+            if profiler is not None:
+                profiler.mark("write")
+            await loop.run_in_executor(self.spi, self.show)
+            if profiler is not None:
+                profiler.mark("show") # includes the hop to the SPI thread and back
+            self.frames += 1
+            if self.show_seconds is not None:
+                self.show_seconds.observe(self.last_show) # back on the loop, see metrics.py
+            await asyncio.sleep(max(0.0, self.period - (loop.time() - started)))
+            if profiler is not None:
+                profiler.mark("wait")
+                profiler.end_frame()
+
+    def show(self):
+        # runs on the SPI thread
+        started = time.perf_counter()
+        self.device.show()
+        self.last_show = time.perf_counter() - started
+
+    def close(self):
+        self.spi.shutdown(wait=False)
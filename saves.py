@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# Saved board storage helpers for websocket-quart.py.
+#
+# Saves are written as <slug>.wps: a small header, the metadata as JSON, then the
+# board as packed x-major RGB (the FrameBuffer.tobytes() layout), optionally zlib
+# compressed.  Older <slug>.json saves with nested "pixels" lists still load, and
+# `python3 saves.py migrate` converts them in bulk.
+#
+#   magic "WPSV" | version:u8 | flags:u8 | width:u16 | height:u16 | meta length:u32
+#   | meta JSON (utf-8) | RGB payload
+#
+# All of the file I/O here is blocking.  The web server runs it on the small SAVE_IO
+# thread pool (see run_io()), writes through atomic_write() so a reader only ever sees
+# a whole old file or a whole new one, and funnels writes through SaveWriter so
+# overlapping saves of the same slug are coalesced instead of racing.
+#
+# SaveIndex keeps the listing metadata (name, slug, timestamp, size) for every save so
+# that /api/saves never has to parse pixel payloads.  Files are tracked by mtime and
+# size; only new or changed files get re-read, and the index is persisted next to the
+# saves so a restart doesn't have to read everything again either.
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+INDEX_NAME = ".index.json"
+SAVE_MAGIC = b'WPSV'
+SAVE_VERSION = 1
+FLAG_ZLIB = 0x01
+SAVE_HEADER = struct.Struct('<4sBBHHI')
+BINARY_SUFFIX = ".wps"
+LEGACY_SUFFIX = ".json"
+SAVE_SUFFIXES = (BINARY_SUFFIX, LEGACY_SUFFIX)
+SAVE_MIMETYPE = "application/octet-stream"
+SAVE_IO_WORKERS = 2
+
+SAVE_IO = ThreadPoolExecutor(max_workers=SAVE_IO_WORKERS, thread_name_prefix="saves")
+
+
+async def run_io(fn, *args, **kwargs):
+    # run blocking save I/O on the SAVE_IO pool instead of the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(SAVE_IO, functools.partial(fn, *args, **kwargs))
+
+
+def atomic_write(path, data):
+    # temp file in the same directory, fsync, then rename over the target
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with tmp.open('wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+    try: # make the rename itself durable
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class SaveWriter:
+    # one write per key at a time; requests that arrive while a write is running are
+    # coalesced so only the newest one is written next, and everyone waiting gets its result
+    def __init__(self, executor=SAVE_IO):
+        self.executor = executor
+        self.latest = {} # key -> {"job": callable, "future": Future, "started": bool, "task": Task}
+
+    async def submit(self, key, job):
+        loop = asyncio.get_running_loop()
+        queued = self.latest.get(key)
+        if queued is not None and not queued["started"]:
+            queued["job"] = job # nobody has written the older request yet; newer data wins
+            return await asyncio.shield(queued["future"])
+        mine = {"job": job, "future": loop.create_future(), "started": False}
+        self.latest[key] = mine
+        # the write runs in its own task: if this submitter is cancelled (its client went away),
+        # the write still happens and whoever coalesced into it still gets the result
+        mine["task"] = loop.create_task(self._write(key, mine, queued))
+        return await asyncio.shield(mine["future"])
+
+    async def _write(self, key, mine, queued):
+        loop = asyncio.get_running_loop()
+        try:
+            if queued is not None:
+                await asyncio.wait([queued["future"]]) # never overlap two writes to the same file
+            mine["started"] = True
+            mine["future"].set_result(await loop.run_in_executor(self.executor, mine["job"]))
+        except Exception as exc:
+            mine["future"].set_exception(exc)
+        finally:
+            if not mine["future"].done(): # cancelled, e.g. the loop is shutting down
+                mine["future"].cancel()
+            if self.latest.get(key) is mine:
+                del self.latest[key]
+
+
+SORT_FIELDS = ("slug", "name", "saved_at")
+
+
+class SaveFormatError(ValueError):
+    pass
+
+
+def encode_save(meta, rgb, compress=True):
+    # meta needs width and height; everything else in it is stored as-is
+    width, height = meta["width"], meta["height"]
+    if len(rgb) != width * height * 3:
+        raise SaveFormatError(f"Board is {len(rgb)} bytes, expected {width * height * 3}.")
+    extra = {k: v for k, v in meta.items() if k not in ("width", "height", "pixels")}
+    meta_bytes = json.dumps(extra, separators=(',', ':')).encode('utf-8')
+    payload = zlib.compress(bytes(rgb), 6) if compress else bytes(rgb)
+    flags = FLAG_ZLIB if compress else 0
+    return SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, flags, width, height, len(meta_bytes)) + meta_bytes + payload
+
+
+def decode_header(data):
+    # returns (meta, flags, payload offset) from the start of a .wps file
+    try:
+        magic, version, flags, width, height, meta_len = SAVE_HEADER.unpack_from(data)
+    except struct.error:
+        raise SaveFormatError("Save is too short to have a header.")
+    if magic != SAVE_MAGIC:
+        raise SaveFormatError("Not a wallpretty save.")
+    if version > SAVE_VERSION:
+        raise SaveFormatError(f"Save format version {version} is newer than this server.")
+    start = SAVE_HEADER.size
+    try:
+        meta = json.loads(bytes(data[start:start + meta_len]).decode('utf-8'))
+    except ValueError as exc:
+        raise SaveFormatError(f"Save metadata is unreadable: {exc}")
+    meta["width"] = width
+    meta["height"] = height
+    return meta, flags, start + meta_len
+
+
+def decode_save(data):
+    # returns (meta, rgb); rgb is a view into data when the save isn't compressed
+    meta, flags, offset = decode_header(data)
+    payload = memoryview(data)[offset:]
+    rgb = zlib.decompress(payload) if flags & FLAG_ZLIB else payload
+    if len(rgb) != meta["width"] * meta["height"] * 3:
+        raise SaveFormatError("Save payload doesn't match its dimensions.")
+    return meta, rgb
+
+
+def pixels_to_rgb(columns):
+    # legacy nested pixels (columns[x][y] == [r, g, b]) -> packed x-major RGB
+    return bytes(value for column in columns for rgb in column for value in rgb)
+
+
+def rgb_to_pixels(rgb, width, height):
+    return [[list(rgb[(x * height + y) * 3:(x * height + y) * 3 + 3]) for y in range(height)] for x in range(width)]
+
+
+def find_save(save_dir, slug):
+    # the stored file for a slug, preferring the binary format
+    for suffix in SAVE_SUFFIXES:
+        path = Path(save_dir) / f"{slug}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def read_save(path):
+    # (meta, rgb) from either format
+    path = Path(path)
+    if path.suffix == BINARY_SUFFIX:
+        return decode_save(path.read_bytes())
+    with path.open('r', encoding='utf-8') as fp:
+        record = json.load(fp)
+    if not isinstance(record.get("pixels"), list):
+        raise SaveFormatError("Saved file is missing pixel data.")
+    meta = {k: v for k, v in record.items() if k != "pixels"}
+    meta.setdefault("slug", path.stem)
+    meta.setdefault("name", path.stem)
+    meta.setdefault("width", len(record["pixels"]))
+    meta.setdefault("height", len(record["pixels"][0]) if record["pixels"] else 0)
+    return meta, pixels_to_rgb(record["pixels"])
+
+
+def read_binary_meta(path):
+    # just the header and metadata; the pixel payload is never read
+    with Path(path).open('rb') as fp:
+        head = fp.read(SAVE_HEADER.size)
+        if len(head) < SAVE_HEADER.size:
+            raise SaveFormatError("Save is too short to have a header.")
+        meta_len = SAVE_HEADER.unpack(head)[5]
+        meta, _, _ = decode_header(head + fp.read(meta_len))
+    return meta
+
+
+def legacy_record(meta, rgb):
+    # the JSON shape /api/saves/<slug> has always returned
+    record = dict(meta)
+    record["pixels"] = rgb_to_pixels(rgb, meta["width"], meta["height"])
+    return record
+
+
+def write_save(save_dir, meta, rgb, compress=True, index=None):
+    # encode and atomically write <slug>.wps, retire any legacy .json for the slug, update the index
+    path = Path(save_dir) / f"{meta['slug']}{BINARY_SUFFIX}"
+    atomic_write(path, encode_save(meta, rgb, compress))
+    if index is not None:
+        index.update(path, meta)
+    legacy_path = path.with_suffix(LEGACY_SUFFIX)
+    try:
+        legacy_path.unlink()
+        if index is not None:
+            index.forget(legacy_path)
+    except FileNotFoundError:
+        pass
+    return path
+
+
+def migrate(save_dir, compress=True, keep_json=False):
+    # convert every legacy .json save in save_dir to .wps; returns how many were converted
+    converted = 0
+    for path in sorted(Path(save_dir).glob(f"*{LEGACY_SUFFIX}")):
+        if path.name.startswith('.'):
+            continue
+        try:
+            meta, rgb = read_save(path)
+        except (OSError, ValueError) as exc:
+            print(f"skipping {path.name}: {exc}")
+            continue
+        atomic_write(path.with_suffix(BINARY_SUFFIX), encode_save(meta, rgb, compress))
+        if not keep_json:
+            path.unlink()
+        converted += 1
+    return converted
+
+
+class SaveIndex:
+    def __init__(self, save_dir, default_width=10, default_height=20):
+        self.save_dir = Path(save_dir)
+        self.index_path = self.save_dir / INDEX_NAME
+        self.default_width = default_width
+        self.default_height = default_height
+        self.entries = {} # file name -> {"mtime_ns": ..., "size": ..., "meta": {...}}
+        self.lock = threading.RLock() # refreshed and updated from the SAVE_IO threads
+        self._load()
+
+    def _load(self):
+        try:
+            with self.index_path.open('r', encoding='utf-8') as fp:
+                self.entries = json.load(fp).get("entries", {})
+        except (OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def _persist(self):
+        try:
+            atomic_write(self.index_path, json.dumps({"entries": self.entries}).encode('utf-8'))
+        except OSError:
+            pass # the index is only a cache; the next refresh will rebuild it
+
+    def read_meta(self, path):
+        # only done for files the index hasn't seen at this mtime; legacy JSON needs a full parse
+        if path.suffix == BINARY_SUFFIX:
+            return self.meta_from_record(read_binary_meta(path), path.stem)
+        with path.open('r', encoding='utf-8') as fp:
+            payload = json.load(fp)
+        return self.meta_from_record(payload, path.stem)
+
+    def meta_from_record(self, record, stem):
+        return {
+            "name": record.get("name", stem),
+            "slug": record.get("slug", stem),
+            "saved_at": record.get("saved_at"),
+            "width": record.get("width", self.default_width),
+            "height": record.get("height", self.default_height),
+        }
+
+    def refresh(self):
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        # stat every save file; re-read only the ones that are new or changed
+        changed = False
+        seen = set()
+        with os.scandir(self.save_dir) as it:
+            for dirent in it:
+                if dirent.name.startswith('.') or not dirent.name.endswith(SAVE_SUFFIXES) or not dirent.is_file():
+                    continue
+                seen.add(dirent.name)
+                st = dirent.stat()
+                entry = self.entries.get(dirent.name)
+                if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                    continue
+                try:
+                    meta = self.read_meta(Path(dirent.path))
+                except (OSError, ValueError):
+                    if self.entries.pop(dirent.name, None) is not None:
+                        changed = True
+                    continue
+                self.entries[dirent.name] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "meta": meta}
+                changed = True
+        for name in list(self.entries):
+            if name not in seen: # removed behind our back
+                del self.entries[name]
+                changed = True
+        if changed:
+            self._persist()
+
+    def update(self, path, record):
+        # record a save we just wrote without re-reading it
+        path = Path(path)
+        st = path.stat()
+        with self.lock:
+            self.entries[path.name] = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "meta": self.meta_from_record(record, path.stem),
+            }
+            self._persist()
+
+    def forget(self, path):
+        with self.lock:
+            if self.entries.pop(Path(path).name, None) is not None:
+                self._persist()
+
+    def listing(self, sort="slug", descending=False, offset=0, limit=None):
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Can't sort saves by '{sort}'.")
+        by_slug = {}
+        with self.lock:
+            entries = list(self.entries.items())
+        for name, entry in entries: # a slug saved in both formats is listed once, binary first
+            slug = entry["meta"]["slug"]
+            if slug not in by_slug or name.endswith(BINARY_SUFFIX):
+                by_slug[slug] = entry["meta"]
+        metas = list(by_slug.values())
+        metas.sort(key=lambda meta: (str(meta.get(sort) or "").casefold(), meta.get("slug") or ""), reverse=descending)
+        end = None if limit is None else offset + limit
+        return len(metas), metas[offset:end]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Saved board maintenance")
+    parser.add_argument("command", choices=["migrate"], help="migrate: convert legacy .json saves to .wps")
+    parser.add_argument("save_dir", nargs="?", default=str(Path(__file__).resolve().parent / "saves"), help="directory holding the saves (default=./saves)")
+    parser.add_argument("--raw", action="store_true", help="store the pixels uncompressed")
+    parser.add_argument("--keep-json", action="store_true", help="leave the old .json files in place")
+    args = parser.parse_args()
+    count = migrate(args.save_dir, compress=not args.raw, keep_json=args.keep_json)
+    print(f"converted {count} save{'' if count == 1 else 's'}")
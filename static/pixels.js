@@ -1,8 +1,23 @@
 let ws = null;
+// binary pixel protocol (see wire.py): opt in on connect, fall back to JSON until the server agrees
+const PREFER_BINARY = true;
+const OP_PIXELS = 0x01;
+const OP_FRAME = 0x02;
+const OP_DELTA = 0x03;
+const PIXEL_RECORD_SIZE = 7;
+// effect frames are streamed as deltas (see delta.py) against the previous frame in the stream
+const DELTA_HEADER_SIZE = 9;
+const DELTA_KEYFRAME = 0x00;
+const DELTA_RUNS = 0x01;
+const DELTA_RUN_HEADER_SIZE = 4;
+let streamFrame = null;
+let streamSeq = 0;
+let binaryProtocol = false;
 let isPainting = false;
 const paintedCells = new Set();
 const coordToCell = new Map();
 let savedStates = [];
+const SAVE_FADE_SECONDS = 0.5;
 
 const clampColorValue = (value) => {
   const numeric = parseInt(value, 10);
@@ -43,6 +58,55 @@ const safeSend = (payload) => {
   }
 };
 
+const encodePixels = (records) => {
+  const buffer = new ArrayBuffer(1 + records.length * PIXEL_RECORD_SIZE);
+  const view = new DataView(buffer);
+  view.setUint8(0, OP_PIXELS);
+  records.forEach(([x, y, r, g, b], index) => {
+    const offset = 1 + index * PIXEL_RECORD_SIZE;
+    view.setUint16(offset, x, true);
+    view.setUint16(offset + 2, y, true);
+    view.setUint8(offset + 4, r);
+    view.setUint8(offset + 5, g);
+    view.setUint8(offset + 6, b);
+  });
+  return buffer;
+};
+
+const sendPixels = (records) => {
+  if (!ws || ws.readyState !== WebSocket.OPEN || !records.length) {
+    return;
+  }
+  if (binaryProtocol) {
+    ws.send(encodePixels(records));
+    return;
+  }
+  if (records.length === 1) {
+    ws.send(JSON.stringify({ Type: 'Pixel', Data: records[0] }));
+    return;
+  }
+  ws.send(JSON.stringify({ Type: 'Pixels', Data: records }));
+};
+
+// paint strokes are gathered and sent once per animation frame as a single batch
+let pendingStroke = [];
+let strokeFlushScheduled = false;
+
+const flushStroke = () => {
+  strokeFlushScheduled = false;
+  const records = pendingStroke;
+  pendingStroke = [];
+  sendPixels(records);
+};
+
+const queuePixel = (record) => {
+  pendingStroke.push(record);
+  if (!strokeFlushScheduled) {
+    strokeFlushScheduled = true;
+    window.requestAnimationFrame(flushStroke);
+  }
+};
+
 const setSaveStatus = (message, state = 'info') => {
   const status = document.getElementById('saveStatus');
   if (!status) {
@@ -154,33 +218,6 @@ const handleSaveSnapshot = async () => {
   }
 };
 
-const applySavedPixels = (pixels) => {
-  if (!Array.isArray(pixels)) {
-    throw new Error('Saved pixel data is invalid.');
-  }
-  let updates = 0;
-  for (let x = 0; x < pixels.length; x += 1) {
-    const column = pixels[x];
-    if (!Array.isArray(column)) {
-      continue;
-    }
-    for (let y = 0; y < column.length; y += 1) {
-      const triple = column[y];
-      if (!Array.isArray(triple) || triple.length < 3) {
-        continue;
-      }
-      const [r, g, b] = triple.map((value) => clampColorValue(value));
-      const cell = coordToCell.get(`${x}-${y}`);
-      if (cell) {
-        cell.style.backgroundColor = `rgb(${r}, ${g}, ${b})`;
-      }
-      safeSend({ Type: 'Pixel', Data: [x, y, r, g, b] });
-      updates += 1;
-    }
-  }
-  return updates;
-};
-
 const handleLoadSnapshot = async () => {
   const select = document.getElementById('savedStateSelect');
   if (!select) {
@@ -193,7 +230,14 @@ const handleLoadSnapshot = async () => {
   }
   setSaveStatus('Loading saved state...', 'info');
   try {
-    const response = await fetch(`/api/saves/${encodeURIComponent(slug)}`);
+    // the server puts the save on the wall in one frame and broadcasts the new board to everyone
+    const response = await fetch(`/api/saves/${encodeURIComponent(slug)}/apply`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({ fade: SAVE_FADE_SECONDS })
+    });
     let payload = {};
     try {
       payload = await response.json();
@@ -203,12 +247,9 @@ const handleLoadSnapshot = async () => {
     if (!response.ok) {
       throw new Error(payload.error || 'Unable to load saved state.');
     }
-    if (!Array.isArray(payload.pixels)) {
-      throw new Error('Saved file is missing pixel data.');
-    }
-    const updates = applySavedPixels(payload.pixels);
-    const label = payload.name || slug;
-    setSaveStatus(`Loaded ${label} (${updates} pixels).`, 'success');
+    const save = payload.save || {};
+    const label = save.name || slug;
+    setSaveStatus(`Loaded ${label} (${(save.width || 0) * (save.height || 0)} pixels).`, 'success');
   } catch (error) {
     console.error('Failed to load saved state', error);
     setSaveStatus(error.message || 'Unable to load saved state.', 'error');
@@ -248,10 +289,7 @@ function clickCell(cell) {
   }
   const color = getCurrentColor();
   cell.style.backgroundColor = color.css;
-  safeSend({
-    Type: 'Pixel',
-    Data: [Number(cell.dataset.x), Number(cell.dataset.y), color.r, color.g, color.b]
-  });
+  queuePixel([Number(cell.dataset.x), Number(cell.dataset.y), color.r, color.g, color.b]);
 }
 
 function brushClick(brush) {
@@ -281,16 +319,120 @@ const appendChat = (message) => {
   chatLog.scrollTop = chatLog.scrollHeight;
 };
 
-const handlePixelMessage = (data) => {
-  const [x, y, r, g, b] = data;
-  const key = `${x}-${y}`;
-  const cell = coordToCell.get(key);
+const paintCell = (x, y, r, g, b) => {
+  const cell = coordToCell.get(`${x}-${y}`);
   if (cell) {
     cell.style.backgroundColor = `rgb(${r}, ${g}, ${b})`;
   }
 };
 
+const handlePixelMessage = (data) => {
+  const [x, y, r, g, b] = data;
+  paintCell(x, y, r, g, b);
+};
+
+const handlePixelsMessage = (data) => {
+  if (!Array.isArray(data)) {
+    return;
+  }
+  data.forEach(([x, y, r, g, b]) => {
+    paintCell(x, y, r, g, b);
+  });
+};
+
+const handleBinaryMessage = (buffer) => {
+  const view = new DataView(buffer);
+  if (!view.byteLength) {
+    return;
+  }
+  const op = view.getUint8(0);
+  if (op === OP_PIXELS) {
+    for (let offset = 1; offset + PIXEL_RECORD_SIZE <= view.byteLength; offset += PIXEL_RECORD_SIZE) {
+      paintCell(
+        view.getUint16(offset, true),
+        view.getUint16(offset + 2, true),
+        view.getUint8(offset + 4),
+        view.getUint8(offset + 5),
+        view.getUint8(offset + 6)
+      );
+    }
+  } else if (op === OP_FRAME) {
+    const width = view.getUint16(1, true);
+    const height = view.getUint16(3, true);
+    const rgb = new Uint8Array(buffer, 5);
+    for (let x = 0; x < width; x += 1) {
+      for (let y = 0; y < height; y += 1) {
+        const offset = (x * height + y) * 3;
+        paintCell(x, y, rgb[offset], rgb[offset + 1], rgb[offset + 2]);
+      }
+    }
+  } else if (op === OP_DELTA) {
+    handleDeltaMessage(view, buffer);
+  } else {
+    console.log('Unhandled binary opcode:', op);
+  }
+};
+
+const paintStreamPixel = (index, height) => {
+  const offset = index * 3;
+  paintCell(Math.floor(index / height), index % height, streamFrame[offset], streamFrame[offset + 1], streamFrame[offset + 2]);
+};
+
+const handleDeltaMessage = (view, buffer) => {
+  if (view.byteLength <= DELTA_HEADER_SIZE) {
+    return;
+  }
+  const seq = view.getUint32(1, true);
+  const width = view.getUint16(5, true);
+  const height = view.getUint16(7, true);
+  const kind = view.getUint8(DELTA_HEADER_SIZE);
+  const body = DELTA_HEADER_SIZE + 1;
+  if (kind === DELTA_KEYFRAME) {
+    streamFrame = new Uint8Array(buffer.slice(body));
+    for (let index = 0; index < width * height && index * 3 < streamFrame.length; index += 1) {
+      paintStreamPixel(index, height);
+    }
+  } else if (kind === DELTA_RUNS) {
+    if (!streamFrame || seq !== ((streamSeq + 1) >>> 0)) {
+      streamFrame = null; // missed a frame; wait for the next keyframe
+      return;
+    }
+    let offset = body;
+    while (offset + DELTA_RUN_HEADER_SIZE <= view.byteLength) {
+      const start = view.getUint16(offset, true);
+      const length = view.getUint16(offset + 2, true);
+      offset += DELTA_RUN_HEADER_SIZE;
+      streamFrame.set(new Uint8Array(buffer, offset, length * 3), start * 3);
+      for (let index = start; index < start + length; index += 1) {
+        paintStreamPixel(index, height);
+      }
+      offset += length * 3;
+    }
+  } else {
+    return;
+  }
+  streamSeq = seq;
+};
+
+const handleSnapshotMessage = (data) => {
+  if (!data || !Array.isArray(data.Pixels)) {
+    return;
+  }
+  const columns = data.Pixels;
+  for (let x = 0; x < columns.length; x += 1) {
+    const column = columns[x];
+    for (let y = 0; y < column.length; y += 1) {
+      const [r, g, b] = column[y];
+      paintCell(x, y, r, g, b);
+    }
+  }
+};
+
 const handleSocketMessage = (event) => {
+  if (event.data instanceof ArrayBuffer) {
+    handleBinaryMessage(event.data);
+    return;
+  }
   let incoming;
   try {
     incoming = JSON.parse(event.data);
@@ -305,9 +447,21 @@ const handleSocketMessage = (event) => {
     case 'Pixel':
       handlePixelMessage(incoming.Data);
       break;
+    case 'Pixels':
+      handlePixelsMessage(incoming.Data);
+      break;
+    case 'Snapshot':
+      handleSnapshotMessage(incoming.Data);
+      break;
     case 'System':
       console.log('System message:', incoming.Data);
       break;
+    case 'Animation':
+      console.log('Animation:', incoming.Data);
+      break;
+    case 'Protocol':
+      binaryProtocol = incoming.Data === 'binary';
+      break;
     default:
       console.log('Unhandled message type:', incoming);
       break;
@@ -369,6 +523,7 @@ const stopPainting = () => {
   }
   isPainting = false;
   paintedCells.clear();
+  flushStroke();
 };
 
 const handleCellKeyDown = (event) => {
@@ -396,8 +551,13 @@ const initWebSocket = () => {
   const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
   const wsUrl = `${protocol}://${window.location.host}/ws`;
   ws = new WebSocket(wsUrl);
+  ws.binaryType = 'arraybuffer';
+  binaryProtocol = false;
   ws.addEventListener('message', handleSocketMessage);
   ws.addEventListener('open', () => {
+    if (PREFER_BINARY) {
+      safeSend({ Type: 'Protocol', Data: 'binary' });
+    }
     console.log('Requesting initial board state');
     safeSend({ Type: 'Update' });
   });
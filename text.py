@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Text on the wall: TTF glyphs rasterized to board resolution, and scrolling marquees.
+# Each glyph is rendered once per (font, size, character) and kept in a small LRU cache,
+# so a string is just its cached glyphs laid side by side.  A Marquee renders its whole
+# message into one x-major strip (board layout, y=0 at the bottom) and every frame is a
+# slice of that strip, so scrolling costs no rendering at all.
+#
+#   python3 text.py "hello wall" --height 20 > preview.txt
+
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+from layout import Layout
+
+DEFAULT_FONT = '/usr/share/fonts/truetype/freefont/FreeMono.ttf' # what letters.py started with
+
+
+class GlyphCache:
+    def __init__(self, max_glyphs=2048):
+        self.max_glyphs = max_glyphs
+        self.glyphs = OrderedDict() # (font, size, char) -> (line height, advance) uint8 mask, least recently used first
+        self.fonts = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # marquees are rendered on animation worker threads
+
+    def font(self, font, size):
+        key = (font, size)
+        if key not in self.fonts:
+            try:
+                self.fonts[key] = ImageFont.truetype(font, size)
+            except OSError: # font isn't installed here; Pillow's own font still gets text on the wall
+                try:
+                    self.fonts[key] = ImageFont.load_default(size)
+                except TypeError: # before Pillow 10.1 (e.g. Raspberry Pi OS's python3-pil) the default font is one fixed-size bitmap
+                    raise OSError(f"Font {font} not found, and Pillow {PIL.__version__} has no scalable default font to use instead; "
+                                  "install the font, pass another one, or upgrade Pillow to 10.1 or newer.") from None
+        return self.fonts[key]
+
+    def fit_size(self, font, height):
+        # the largest size whose line (ascent + descent) fits in height rows
+        for size in range(height, 1, -1):
+            ascent, descent = self.font(font, size).getmetrics()
+            if ascent + descent <= height:
+                return size
+        return 1
+
+    def glyph(self, font, size, char):
+        key = (font, size, char)
+        with self.lock:
+            mask = self.glyphs.get(key)
+            if mask is not None:
+                self.glyphs.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+            pil_font = self.font(font, size)
+        ascent, descent = pil_font.getmetrics()
+        advance = max(1, round(pil_font.getlength(char)))
+        img = Image.new('L', (advance, ascent + descent), color=0)
+        ImageDraw.Draw(img).text((0, 0), char, font=pil_font, fill=255)
+        mask = np.asarray(img, dtype=np.uint8) # rows top to bottom
+        mask.setflags(write=False) # shared between every string that uses it
+        with self.lock:
+            self.glyphs[key] = mask
+            while len(self.glyphs) > self.max_glyphs:
+                self.glyphs.popitem(last=False)
+        return mask
+
+    def render(self, text, height, font=DEFAULT_FONT, size=None):
+        # (height, width) uint8 coverage of text, vertically centered, rows top to bottom
+        if size is None:
+            size = self.fit_size(font, height)
+        glyphs = [self.glyph(font, size, char) for char in text]
+        line_height = glyphs[0].shape[0] if glyphs else height
+        line = np.hstack(glyphs) if glyphs else np.zeros((line_height, 0), dtype=np.uint8)
+        out = np.zeros((height, line.shape[1]), dtype=np.uint8)
+        top = (height - line_height) // 2
+        src = line[max(0, -top):max(0, -top) + height]
+        out[max(0, top):max(0, top) + src.shape[0]] = src
+        return out
+
+
+glyph_cache = GlyphCache()
+
+
+def colorize(mask, color, background=(0, 0, 0)):
+    # (height, width) coverage to board layout: (width, height, 3) uint8 with y=0 on the bottom row
+    alpha = mask[::-1].T[..., None].astype(np.float32) / 255
+    color = np.asarray(color, dtype=np.float32)
+    background = np.asarray(background, dtype=np.float32)
+    return np.ascontiguousarray(background + (color - background) * alpha + 0.5, dtype=np.uint8)
+
+
+class Marquee:
+    # text scrolling right to left across a width x height board, entering and leaving off-screen
+    def __init__(self, text, width, height, color=(255, 255, 255), background=(0, 0, 0),
+                 font=DEFAULT_FONT, size=None, glyphs=glyph_cache):
+        self.width = width
+        self.height = height
+        mask = glyphs.render(text, height, font, size)
+        blank = np.zeros((height, width), dtype=np.uint8)
+        self.strip = colorize(np.hstack((blank, mask, blank)), color, background)
+
+    def __len__(self):
+        return self.strip.shape[0] - self.width + 1
+
+    def frame(self, i):
+        # (width, height, 3) view into the strip, laid out like FrameBuffer.pixels
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.strip[i:i + self.width]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def strip_frames(self, layout, count=None):
+        # frames in LED strip order, ready for framebuffer.show_frame()
+        if not isinstance(layout, Layout):
+            layout = Layout.from_pgrid(layout)
+        for frame in self:
+            yield layout.to_strip(frame, count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preview how text will look on the wall")
+    parser.add_argument("text")
+    parser.add_argument("--height", type=int, default=20, help="rows on the board (default=20)")
+    parser.add_argument("--font", default=DEFAULT_FONT, help=f"TTF font file (default={DEFAULT_FONT})")
+    parser.add_argument("--size", type=int, default=None, help="font size (default=fit the board)")
+    args = parser.parse_args()
+    mask = glyph_cache.render(args.text, args.height, args.font, args.size)
+    for row in mask:
+        print(''.join('#' if v >= 128 else '+' if v >= 32 else '.' for v in row))
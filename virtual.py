@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# A stand-in WS2801 strip for running and profiling off the Pi.
+# VirtualWS2801 has the Adafruit WS2801Pixels interface and keeps a real pixel buffer laid
+# out the same way (a flat RGB list), so framebuffer.write_strip() and friends take the
+# same paths they take on hardware.  show() costs what the real one does: 24 bits per
+# pixel at the configured SPI clock plus the 2ms latch the Adafruit driver sleeps for.
+# Every shown frame is kept with its timestamp in a ring buffer, and can also be
+# recorded to a .wpa file (see animfile.py) with the timestamps alongside in <file>.times.
+
+import time
+from array import array
+from collections import deque
+
+DEFAULT_SPI_HZ = 1000000 # the clock Adafruit_WS2801.WS2801Pixels sets on its SPI device
+LATCH_SECONDS = 0.002    # WS2801Pixels.show() sleeps this long after the transfer
+
+
+def RGB_to_color(r, g, b):
+    # same packing as Adafruit_WS2801.RGB_to_color
+    return ((r & 0xFF) << 16) | ((g & 0xFF) << 8) | (b & 0xFF)
+
+
+class VirtualWS2801:
+    def __init__(self, count, spi_hz=DEFAULT_SPI_HZ, history=600, record=None, realtime=True,
+                 clock=time.perf_counter, sleep=time.sleep):
+        self._count = count
+        self._pixels = [0] * (count * 3)
+        self.spi_hz = spi_hz
+        self.realtime = realtime # False skips the sleeps but still accounts the time
+        self.clock = clock
+        self.sleep = sleep
+        self.frames = deque(maxlen=history) # (timestamp, strip-order RGB bytes)
+        self.shown = 0
+        self.bytes_sent = 0
+        self.busy = 0.0 # modeled time spent clocking data out
+        self.started = None
+        self.writer = None
+        self.times = None
+        if record:
+            from animfile import AnimationWriter
+            self.writer = AnimationWriter(record, count, 1, 0)
+            self.times = open(f"{record}.times", "wb")
+
+    @property
+    def transfer_seconds(self):
+        return self._count * 24 / self.spi_hz + LATCH_SECONDS
+
+    def count(self):
+        return self._count
+
+    def set_pixel(self, n, color):
+        self._pixels[n * 3] = (color >> 16) & 0xFF
+        self._pixels[n * 3 + 1] = (color >> 8) & 0xFF
+        self._pixels[n * 3 + 2] = color & 0xFF
+
+    def set_pixel_rgb(self, n, r, g, b):
+        self._pixels[n * 3:n * 3 + 3] = [r & 0xFF, g & 0xFF, b & 0xFF]
+
+    def set_pixels(self, color):
+        for n in range(self._count):
+            self.set_pixel(n, color)
+
+    def set_pixels_rgb(self, r, g, b):
+        self._pixels[:] = [r & 0xFF, g & 0xFF, b & 0xFF] * self._count
+
+    def get_pixel(self, n):
+        r, g, b = self._pixels[n * 3:n * 3 + 3]
+        return (r << 16) | (g << 8) | b
+
+    def get_pixel_rgb(self, n):
+        return tuple(self._pixels[n * 3:n * 3 + 3])
+
+    def clear(self):
+        self._pixels[:] = [0] * (self._count * 3)
+
+    def show(self):
+        data = bytes(self._pixels) # what would go out over SPI
+        now = self.clock()
+        if self.started is None:
+            self.started = now
+        self.frames.append((now, data))
+        if self.writer is not None:
+            self.writer.write(data)
+            self.times.write(array('d', [now - self.started]).tobytes())
+        self.shown += 1
+        self.bytes_sent += len(data)
+        self.busy += self.transfer_seconds
+        if self.realtime:
+            self.sleep(self.transfer_seconds)
+
+    def last_frame(self):
+        return self.frames[-1][1] if self.frames else bytes(self._count * 3)
+
+    def stats(self):
+        elapsed = (self.frames[-1][0] - self.started) if self.frames else 0.0
+        return {
+            "pixels": self._count,
+            "spi_hz": self.spi_hz,
+            "frames": self.shown,
+            "bytes": self.bytes_sent,
+            "transfer_ms": round(self.transfer_seconds * 1000, 3),
+            "busy_s": round(self.busy, 4),
+            "fps": round((self.shown - 1) / elapsed, 2) if elapsed > 0 else 0.0,
+            "elapsed_s": round(elapsed, 4),
+        }
+
+    def close(self):
+        if self.writer is not None:
+            if self.shown > 1 and self.frames[-1][0] > self.started:
+                self.writer.fps = (self.shown - 1) / (self.frames[-1][0] - self.started) # what was actually achieved
+            self.writer.close()
+            self.times.close()
+            self.writer = None
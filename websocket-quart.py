@@ -1,14 +1,35 @@
 #!/usr/bin/env python3
 from functools import wraps
 import asyncio
+import itertools
 import json
 import argparse
 from datetime import datetime, timezone
 from pathlib import Path
-import copy
 import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
 # pip3 install quart
 from quart import Quart, render_template, websocket, copy_current_websocket_context, request
+from fanout import ClientOutbox, SlowClientError, OVERFLOW_POLICIES
+import metrics
+from hub import Hub, HubClient, SharedBoard
+import wire
+from render import RenderLoop
+from animation import AnimationRunner
+from framebuffer import FrameBuffer, show_frame
+from layout import Layout
+from output import open_device, device_stats
+from player import Player
+from profiling import open_profile
+from text import Marquee, DEFAULT_FONT
+import effects
+import delta
+import saves
+from saves import SaveIndex, SaveWriter, run_io
 
 # grab PORT from environment if set
 import os
@@ -28,47 +49,52 @@ try: # because I'd still like this to run outside of a Pi
   import RPi.GPIO as GPIO
   import Adafruit_WS2801
   import Adafruit_GPIO.SPI as SPI
-except Exception as ex: # mock-ups if there's no Pi
-  print(f"{OE}Exception caught: {OR}{ex}{OM}")
-  GPIO = None
-  class Adafruit_WS2801:
-    def __init__(self, pixelCount=200, spi=None, gpio=None):
-      pass
-    def RGB_to_color(r, g, b):
-      pass
-    class WS2801Pixels:
-      def __init__(self, things, **kwargs):
-        pass
-      def clear(whatever):
-        pass
-      def show(whatever):
-        pass
-      def set_pixel(pixnum, color, whatever):
-        pass
-  class SPI:
-    def __init__(self, **kwargs):
-      pass
-    def SpiDev(SPI_PORT, SPI_DEVICE):
-      pass
+except Exception as ex: # no Pi; output.open_device() simulates the strip instead (see virtual.py)
+  print(f"{OE}Exception caught: {OR}{ex}{OV}, simulating the LEDs{OM}")
+  GPIO = Adafruit_WS2801 = SPI = None
 
 
 # import specific fancy functions from ws2801_funcs.py
 try: # because this won't work on dev computer
   from ws2801_funcs import *
+  import ws2801_funcs
 except Exception as ex: # more mock-ups
   print(f"{OE}Exception caught: {OR}{ex}{OM}")
-  def rainbow_cycle():
+  ws2801_funcs = None
+  def rainbow_cycle(pixels, wait=0.005):
+    pass
+  def brightness_decrease(pixels, wait=0.01, step=1):
     pass
 
 app = Quart(__name__)
-connected = set()
+connected = {} # websocket -> ClientOutbox
+client_ids = itertools.count(1) # names connections in /metrics
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-b", "--back2front", help="whether to do the back-to-front pixel stacking (default=False)", action="store_true")
 parser.add_argument("-c", "--count", type=int, default=1, help="number of cycles through the program (default=1)")
 parser.add_argument("-f", "--flashes", type=int, default=0, help="number of flashes during cycles (default=0)")
 parser.add_argument("-p", "--pixels", type=int, default=200, help="number of pixels in LED set (default=200)")
+parser.add_argument("--virtual", action="store_true", help="simulate the LEDs instead of using SPI hardware")
+parser.add_argument("--spi-hz", type=int, default=None, help="SPI clock in Hz, real or simulated (default=1000000)")
+parser.add_argument("--record", default=None, help="with --virtual, record every shown frame to this .wpa file")
+parser.add_argument("--chains", default=None, help="split the pixels across SPI chains, one per SPI port, e.g. 0.0:200,1.0:200 (default=one chain on 0.0)")
 parser.add_argument("-l", "--length", type=int, default=10, help="length of rows/number of columns (default=10)")
+parser.add_argument("-r", "--fps", type=float, default=30, help="most frames per second pushed to the LEDs (default=30)")
+parser.add_argument("--cache-mb", type=float, default=32, help="memory for pre-rendered effect frames in MB, used by ws2801_funcs (default=32)")
+parser.add_argument("--cache-dir", default=None, help="spill evicted effect frames to this directory (default=off)")
+parser.add_argument("--raw-saves", action="store_true", help="store saved boards without zlib compression")
+parser.add_argument("-q", "--queue-size", type=int, default=256, help="outbound messages buffered per client (default=256)")
+parser.add_argument("-o", "--overflow", choices=OVERFLOW_POLICIES, default="coalesce", help="what to do when a client's queue fills (default=coalesce)")
+parser.add_argument("-m", "--marquee", action="store_true", help="scroll chat messages across the wall")
+parser.add_argument("--marquee-font", default=DEFAULT_FONT, help=f"TTF font for --marquee (default={DEFAULT_FONT})")
+parser.add_argument("--marquee-fps", type=float, default=12, help="columns per second the marquee scrolls (default=12)")
+parser.add_argument("--layout", default=None, help="LED wiring: serpentine, progressive[:start[:degrees]] or a .json map (default=serpentine from the lower right)")
+parser.add_argument("-w", "--workers", type=int, default=1, help="web worker processes serving websockets; more than 1 moves the LEDs to an owner process (default=1)")
+parser.add_argument("--worker-of", default=None, help=argparse.SUPPRESS) # hub socket; set by the owner when it starts a worker
+parser.add_argument("--board", default=None, help=argparse.SUPPRESS) # shared memory board, ditto
+parser.add_argument("--listen-fd", type=int, default=None, help=argparse.SUPPRESS) # inherited listening socket, ditto
+parser.add_argument("--profile", default=None, help="time every rendered and animated frame; write a Chrome trace to this .json file and print the slowest frames at exit")
 parser.add_argument("-v", "--verbosity", action="count", default=0, help="be more verbose")
 args = parser.parse_args()
 
@@ -78,45 +104,129 @@ PIXEL_COUNT = args.pixels
 if args.verbosity > 0:
   print(f"{OV}Running program for {OR}{args.pixels}{OV} pixels".format(args.pixels))
 
-# Alternatively specify a hardware SPI connection on /dev/spidev0.0:
-SPI_PORT   = 0
-SPI_DEVICE = 0
-pixels = Adafruit_WS2801.WS2801Pixels(PIXEL_COUNT, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE), gpio=GPIO)
-
-
-# Define an Y,X tgrid for pixels with 0,0 in the lower left
-# Assumes back and forth layout of LEDs, starting in lower-right
-ROW_LENGTH = args.length
-COL_LENGTH = int(PIXEL_COUNT / ROW_LENGTH)
-tgrid = []
-for i in range(int(PIXEL_COUNT / ROW_LENGTH)):
-    row = []
-    for j in range(ROW_LENGTH):
-        if (i % 2 == 1): # account for wire snaking back and forth
-            row.insert(j,j + (i*ROW_LENGTH))
-        else:
-            row.insert((j),(i * ROW_LENGTH + ROW_LENGTH) - j -1)
-    tgrid.insert(i,row)
+# one SPI chain on /dev/spidev0.0, or several driven in parallel with --chains; see output.py
+if args.worker_of: # a web worker; the owner process has the LEDs (see hub.py)
+  pixels = None
+else:
+  pixels = open_device(args, Adafruit_WS2801, SPI, GPIO)
+  PIXEL_COUNT = pixels.count()
 
-# transpose to pgrid so we can use X,Y instead of Y,X to address pixels
-pgrid=[]
-for i in range(len(tgrid[0])):
-    row=[]
-    for j in range(len(tgrid)):
-        row.insert(j,tgrid[j][i])
-    pgrid.insert(i,row)
+
+# how the LEDs snake across the grid, 0,0 in the lower left; see layout.py
+# by default rows of ROW_LENGTH go back and forth, starting in lower-right
+layout = Layout.from_spec(args.layout, PIXEL_COUNT, args.length)
+ROW_LENGTH = layout.width
+COL_LENGTH = layout.height
 
 # maintain pixel state for clients who join after start
-pixelState = []
-for column in pgrid:
-    row = []
-    for pixel in column:
-        row.append([0,0,0])
-    pixelState.append(row)
+# (x, y, rgb) uint8 framebuffer; pixelState.pixels[x, y] is what pixel x,y should show
+# with --workers it lives in shared memory: the owner writes it, the workers read it
+hub = None        # the owner's end of the hub, with --workers
+hub_client = None # a worker's end
+shared_board = None
+if args.worker_of:
+  shared_board = SharedBoard.attach(args.board)
+  hub_client = HubClient(args.worker_of, lambda *published: deliver_published(*published))
+elif args.workers > 1:
+  shared_board = SharedBoard.create(ROW_LENGTH, COL_LENGTH)
+pixelState = FrameBuffer(ROW_LENGTH, COL_LENGTH, layout, shared_board.pixels if shared_board else None)
+renderer = RenderLoop(pixels, pixelState, max_fps=args.fps)
+# per-frame timing of the render loop and of effects with --profile; see profiling.py
+profiler = open_profile(args.profile) if args.profile and not args.worker_of else None
+renderer.profiler = profiler
+if ws2801_funcs is not None:
+  ws2801_funcs.profiler = profiler
+renderer_task = None
+lag_task = None # samples event loop lag for /metrics
+hub_task = None # a worker's reader for the owner's broadcasts
+fade_task = None # crossfade to a freshly applied save, see apply_saved_board()
+
+# served at /metrics for Prometheus; see metrics.py
+MESSAGE_TYPES = ("Protocol", "Chat", "Pixel", "Pixels", "Update", "Animation") # anything else is counted as "other"
+registry = metrics.Registry()
+registry.gauge("wall_websockets_connected", "Open websocket connections.", read=lambda: len(connected))
+messages_received = registry.counter("wall_messages_received_total", "Websocket messages received, by Type (binary for binary-protocol frames).", ("type",))
+renderer.show_seconds = registry.histogram("wall_show_seconds", "Time spent in the LED device's show().")
+registry.counter("wall_frames_shown_total", "Frames the render loop has pushed to the LEDs.", read=lambda: renderer.frames)
+broadcast_seconds = registry.histogram("wall_broadcast_seconds", "Time broadcast() takes to queue one message for every client.")
+outbox_delay = registry.histogram("wall_outbox_delay_seconds", "Time from queueing a message for a client to sending it.")
+registry.gauge("wall_outbox_queue_depth", "Messages waiting to be sent, per connected client.", ("client",),
+               read=lambda: {(outbox.name,): len(outbox) for outbox in connected.values()})
+registry.gauge("wall_outbox_dropped", "Messages the overflow policy has dropped for the clients connected now.",
+               read=lambda: sum(outbox.dropped for outbox in connected.values()))
+save_seconds = registry.histogram("wall_save_io_seconds", "Save file latency, by operation.", ("op",))
+loop_lag = registry.histogram("wall_event_loop_lag_seconds", "How late the event loop wakes a sleeping task.")
+loop_lag_last = registry.gauge("wall_event_loop_lag_last_seconds", "Most recent event loop lag sample.")
+
+
+ANIMATION_KEY = ("Animation",) # only the newest effect state matters; also how workers spot it (deliver_published)
+
+
+def announce_animation(state):
+    # let every viewer know what the wall is doing; put the painted board back once an effect ends
+    asyncio.ensure_future(broadcast(json.dumps({"Type": "Animation", "Data": state}), key=ANIMATION_KEY))
+    if state["State"] in ("finished", "stopped", "failed"):
+        renderer.mark_all()
+        stream.force_keyframe() # the next effect starts from a clean slate
+        asyncio.ensure_future(broadcast(snapshot_message(), binary=snapshot_message(binary=True)))
+
+
+class AnimationStream:
+    # effect frames for binary-protocol viewers, as OP_DELTA messages at most once per render tick
+    def __init__(self, keyframe_interval):
+        self.encoder = delta.DeltaEncoder(keyframe_interval)
+        self.seq = 0
+        self.last_sent = 0.0
+
+    def force_keyframe(self):
+        self.encoder.force_keyframe()
+
+    def send(self, strip):
+        now = asyncio.get_running_loop().time()
+        if now - self.last_sent < renderer.period:
+            return # the encoder diffs against the last frame sent, so skipping is safe
+        viewers = [outbox for outbox in connected.values() if outbox.binary]
+        if not viewers and hub is None: # with workers we can't see their viewers, so always send
+            self.force_keyframe() # whoever joins next needs a keyframe
+            return
+        self.last_sent = now
+        board = layout.from_strip(strip).tobytes()
+        self.seq += 1
+        message = wire.encode_delta(self.seq, ROW_LENGTH, COL_LENGTH, self.encoder.encode(board))
+        for outbox in viewers:
+            outbox.put(message)
+        if hub is not None:
+            hub.publish(None, binary=message) # for the workers' binary viewers
+
+stream = AnimationStream(keyframe_interval=max(1, int(args.fps))) # about one keyframe a second
+
+
+def animation_frame(strip):
+    renderer.show_strip(strip)
+    stream.send(strip)
+
+animations = AnimationRunner(PIXEL_COUNT, animation_frame, announce_animation)
+
+
+def rainbow_show(device):
+    # runs on the animation worker thread
+    rainbow_cycle(device)
+    brightness_decrease(device)
+
+
+def marquee_show(device, message, color=(255, 255, 255)):
+    # runs on the animation worker thread; the text is rendered once here, then each frame is a slice
+    marquee = Marquee(message, ROW_LENGTH, COL_LENGTH, color=color, font=args.marquee_font)
+    Player(args.marquee_fps, profiler=profiler).play(marquee.strip_frames(layout, PIXEL_COUNT), lambda frame: show_frame(device, frame, profiler), label="marquee")
+
+
+snapshotCache = {} # serialized Snapshot messages (JSON and binary), rebuilt only after the board changes
 
 SAVE_DIR = Path(__file__).resolve().parent / "saves"
 SAVE_DIR.mkdir(parents=True, exist_ok=True)
 SAVE_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_-]+")
+save_index = SaveIndex(SAVE_DIR, default_width=ROW_LENGTH, default_height=COL_LENGTH)
+save_writer = SaveWriter()
 
 
 def sanitize_save_name(raw_name):
@@ -132,72 +242,221 @@ def sanitize_save_name(raw_name):
 
 
 def snapshot_pixel_state():
-    return copy.deepcopy(pixelState)
+    return pixelState.tobytes()
+
+
+def invalidate_snapshot():
+    snapshotCache.clear()
+    if shared_board is not None:
+        shared_board.bump() # tells the workers their cached snapshots are stale
+
+
+def snapshot_message(binary=False):
+    # whole board in one message; serialized once and reused until something is painted
+    if shared_board is not None and snapshotCache.get("version") != shared_board.version:
+        snapshotCache.clear() # the owner has changed the board since
+        snapshotCache["version"] = shared_board.version
+    if binary not in snapshotCache:
+        if binary:
+            snapshotCache[binary] = wire.encode_frame(ROW_LENGTH, COL_LENGTH, pixelState.tobytes())
+        else:
+            snapshotCache[binary] = json.dumps({
+                "Type": "Snapshot",
+                "Data": {"Width": ROW_LENGTH, "Height": COL_LENGTH, "Pixels": pixelState.tolist()},
+            }, separators=(',', ':'))
+    return snapshotCache[binary]
 
 def collect_websocket(func):
     # when someone connects to /ws, add to inventory of websockets
     @wraps(func)
-    async def wrapper(*args, **kwargs):
+    async def wrapper(*func_args, **func_kwargs): # not *args, that would hide the command line args
         # if args.verbosity > 1: print(f'{OV}entered wrapper(){OM}')
         global connected
-        connected.add(websocket._get_current_object())
+        websock = websocket._get_current_object()
+        connected[websock] = ClientOutbox(websock, maxsize=args.queue_size, policy=args.overflow, name=str(next(client_ids)), delay=outbox_delay)
         try:
-            return await func(*args, **kwargs)
+            return await func(*func_args, **func_kwargs)
         finally:
-            connected.remove(websocket._get_current_object())
+            connected.pop(websock).close()
     return wrapper
 
 
-async def broadcast(message):
-    # broadcast a message to all connected websockets
+def pick_encoding(outbox, message, binary):
+    # binary-protocol clients get the packed form when there is one
+    if binary is not None and outbox.binary:
+        return binary
+    return message
+
+
+def deliver(message, key=None, binary=None):
+    # queue a message for every websocket connected to this process; message None is for binary clients only
+    with broadcast_seconds.time():
+        for outbox in list(connected.values()):
+            if message is None and not outbox.binary:
+                continue
+            outbox.put(pick_encoding(outbox, message, binary), key)
+
+
+async def broadcast(message, key=None, binary=None):
+    # queue a message for every connected websocket; each client's writer task does the sending
+    # key lets the coalesce policy merge repeated updates, e.g. ("Pixel", x, y)
     if args.verbosity > 0: print(f'{OV}broadcasting {OR}{message}{OM}')
-    for websock in connected:
-        await websock.send(message)
+    if hub_client is not None:
+        hub_client.publish(message, binary, key) # the owner passes it to every worker, this one included
+        return
+    deliver(message, key, binary)
+    if hub is not None:
+        hub.publish(message, binary, key)
+
+
+published_animation = None # a worker's copy of the owner's last Animation message, for Update
+
+
+def deliver_published(message, binary, key):
+    # a worker's hub client got a broadcast from the owner
+    global published_animation
+    if key == ANIMATION_KEY:
+        running = json.loads(message)["Data"]["State"] in ("running", "stopping")
+        published_animation = message if running else None
+    deliver(message, key, binary)
+
+
+async def reply(message, binary=None):
+    # queue a message for just the websocket in the current context
+    outbox = connected.get(websocket._get_current_object())
+    if outbox is not None:
+        outbox.put(pick_encoding(outbox, message, binary))
+
+
+async def set_board_pixels(records):
+    # apply a batch of (x, y, r, g, b) with one show() and one broadcast
+    records = [tuple(record) for record in records]
+    if not records:
+        return
+    for x, y, r, g, b in records: # check the whole batch before touching the board
+        if not (0 <= x < ROW_LENGTH and 0 <= y < COL_LENGTH):
+            raise ValueError(f"Pixel {x},{y} is off the board.")
+    packed = wire.encode_pixels(records) # also rejects out-of-range colors
+    pixelState.set_pixels(records)
+    for x, y, r, g, b in records:
+        renderer.mark(x, y) # the render loop pushes it to the strip on its next tick
+    invalidate_snapshot()
+    animations.cancel() # painting takes the wall back from any running effect
+    cancel_fade()
+    if len(records) == 1:
+        x, y, r, g, b = records[0]
+        await broadcast(f'{{"Type":"Pixel","Data":[{x}, {y}, {r}, {g}, {b}]}}', key=("Pixel", x, y), binary=packed)
+    else:
+        await broadcast(json.dumps({"Type": "Pixels", "Data": records}, separators=(',', ':')), binary=packed)
+
+
+def cancel_fade():
+    if fade_task is not None and not fade_task.done():
+        fade_task.cancel()
+
+
+async def crossfade(start, end, seconds):
+    # the wall walks from the old board to the new one; pixelState already holds the new one
+    try:
+        steps = max(1, int(seconds / renderer.period))
+        for frame in effects.crossfade_frames(start, end, steps):
+            renderer.show_strip(frame.tobytes())
+            await asyncio.sleep(renderer.period)
+    finally:
+        renderer.mark_all()
+
+
+async def apply_board(loaded, fade=0):
+    # replace the whole board with one frame: one show() and one Snapshot broadcast
+    global fade_task
+    if hub_client is not None: # the owner applies it and broadcasts the Snapshot
+        hub_client.send_board(loaded.width, loaded.height, fade, loaded.tobytes())
+        return
+    animations.cancel()
+    cancel_fade()
+    before = pixelState.to_strip(PIXEL_COUNT) if fade > 0 else None
+    pixelState.load(loaded)
+    invalidate_snapshot()
+    if fade > 0:
+        fade_task = asyncio.ensure_future(crossfade(before, pixelState.to_strip(PIXEL_COUNT), fade))
+    else:
+        renderer.mark_all()
+    await broadcast(snapshot_message(), binary=snapshot_message(binary=True))
 
 
 async def consumer():
     # what to do with incoming websocket messages
-    global pixelState
-    global pgrid
     while True:
         data = await websocket.receive()
         if args.verbosity > 0: print(f'{OV}received data {OR}{data}{OM}', end='')
-        try:
-            dataj = json.loads(data)
-            if dataj["Type"] == "Chat": # client is chatting
-                if args.verbosity > 0: print(f'{OV}, broadcasting as chat {OM}')
-                if dataj["Data"].lower() == "rainbow":
-                    rainbow_cycle(pixels)
-                    brightness_decrease(pixels)
-                if dataj["Data"].lower() == "clear":
-                    pixels.clear()
-                    for column, col in zip(pixelState, range(ROW_LENGTH)):
-                        for pixel, pix in zip(column, range(COL_LENGTH)):
-                            pixelState[col][pix] = [0,0,0]
-                            await broadcast(f'{{"Type":"Pixel","Data":[{col}, {pix}, 0, 0, 0]}}')
-                    pixels.show()
-                await broadcast(f'{{"Type":"Chat","Data":"{dataj["Data"]}"}}')
-            if dataj["Type"] == "Pixel": # client is setting one pixel; update the board
-                # incoming message looks like {"Type":"Pixel","Data":[3, 19, 255,  165,  0]}
-                x = dataj['Data'][0]
-                y = dataj['Data'][1]
-                r = dataj['Data'][2]
-                g = dataj['Data'][3]
-                b = dataj['Data'][4]
-                # if args.verbosity > 0: print (f'{OV}Setting pixel with dataj {OR}{dataj}{OM}')
-                pixelState[x][y] = [r,g,b]
-                pixels.set_pixel(pgrid[x][y],Adafruit_WS2801.RGB_to_color( r, g, b ))
-                pixels.show()
-                if args.verbosity > 0: print(f'{OV}, broadcasting as pixel {OM}')
-                await broadcast(f'{{"Type":"Pixel","Data":{dataj["Data"]}}}')
-            if dataj["Type"] == "Update": # client wants to know the whole image
-                if args.verbosity > 0: print(f'{OV}, updating board with ROW_LENGTH {OR}{ROW_LENGTH} {OM}')
-                for column, col in zip(pixelState, range(ROW_LENGTH)):
-                    for pixel, pix in zip(column, range(COL_LENGTH)):
-                        await broadcast(f'{{"Type":"Pixel","Data":[{col}, {pix}, {pixelState[col][pix][0]}, {pixelState[col][pix][1]}, {pixelState[col][pix][2]}]}}')
-        except Exception as ex: # catch exceptions
-            print(f'{OE}*** Exception in websocket-quart.py, consumer(): {OR}{ex}{OM}') 
-            # return {"Success":False, "Error":f"{inspect.currentframe().f_code.co_name}-Exception: {ex}"}
+        await handle_message(data)
+
+
+BOARD_TYPES = ("Pixel", "Pixels", "Chat", "Animation") # with --workers, the owner handles these
+
+
+async def handle_message(data):
+    # one client message; the owner's hub calls this too, with messages the workers pass on
+    try:
+        if isinstance(data, bytes): # binary-protocol client
+            messages_received.inc("binary")
+            if hub_client is not None:
+                hub_client.send_message(data)
+            elif wire.opcode(data) == wire.OP_PIXELS:
+                if args.verbosity > 0: print(f'{OV}, applying binary pixels {OM}')
+                await set_board_pixels(wire.decode_pixels(data))
+            return
+        dataj = json.loads(data)
+        messages_received.inc(dataj["Type"] if dataj["Type"] in MESSAGE_TYPES else "other")
+        if hub_client is not None and dataj["Type"] in BOARD_TYPES:
+            hub_client.send_message(data) # the owner applies it and broadcasts the result
+            return
+        if dataj["Type"] == "Protocol": # client is picking JSON or binary pixel messages
+            connected[websocket._get_current_object()].binary = dataj["Data"] == "binary"
+            await reply(json.dumps({"Type": "Protocol", "Data": "binary" if dataj["Data"] == "binary" else "json"}))
+        if dataj["Type"] == "Chat": # client is chatting
+            if args.verbosity > 0: print(f'{OV}, broadcasting as chat {OM}')
+            if dataj["Data"].lower() == "rainbow":
+                await animations.start("rainbow", rainbow_show)
+            if dataj["Data"].lower() == "stop":
+                await animations.stop()
+            if dataj["Data"].lower() == "clear":
+                pixelState.fill((0, 0, 0))
+                invalidate_snapshot()
+                renderer.mark_all()
+                await broadcast(snapshot_message(), binary=snapshot_message(binary=True))
+            if args.marquee and dataj["Data"].lower() not in ("rainbow", "stop", "clear"):
+                await animations.start("marquee", marquee_show, dataj["Data"])
+            await broadcast(f'{{"Type":"Chat","Data":"{dataj["Data"]}"}}')
+        if dataj["Type"] == "Pixel": # client is setting one pixel; update the board
+            # incoming message looks like {"Type":"Pixel","Data":[3, 19, 255,  165,  0]}
+            x = dataj['Data'][0]
+            y = dataj['Data'][1]
+            r = dataj['Data'][2]
+            g = dataj['Data'][3]
+            b = dataj['Data'][4]
+            # if args.verbosity > 0: print (f'{OV}Setting pixel with dataj {OR}{dataj}{OM}')
+            if args.verbosity > 0: print(f'{OV}, broadcasting as pixel {OM}')
+            await set_board_pixels([(x, y, r, g, b)])
+        if dataj["Type"] == "Pixels": # client is setting a batch of pixels, e.g. a loaded save or a paint stroke
+            # incoming message looks like {"Type":"Pixels","Data":[[3, 19, 255, 165, 0], [4, 19, 255, 165, 0]]}
+            if args.verbosity > 0: print(f'{OV}, broadcasting as {OR}{len(dataj["Data"])}{OV} pixels {OM}')
+            await set_board_pixels(dataj['Data'])
+        if dataj["Type"] == "Update": # client wants to know the whole image
+            if args.verbosity > 0: print(f'{OV}, sending snapshot with ROW_LENGTH {OR}{ROW_LENGTH} {OM}')
+            await reply(snapshot_message(), binary=snapshot_message(binary=True)) # only the client that asked needs it
+            if animations.running:
+                await reply(json.dumps({"Type": "Animation", "Data": animations.state()}))
+            elif published_animation is not None: # a worker; the owner runs the effects
+                await reply(published_animation)
+        if dataj["Type"] == "Animation": # client is starting or stopping an effect, e.g. {"Type":"Animation","Data":"stop"}
+            if dataj["Data"] == "stop":
+                await animations.stop()
+            elif dataj["Data"] == "rainbow":
+                await animations.start("rainbow", rainbow_show)
+    except Exception as ex: # catch exceptions
+        print(f'{OE}*** Exception in websocket-quart.py, consumer(): {OR}{ex}{OM}') 
+        # return {"Success":False, "Error":f"{inspect.currentframe().f_code.co_name}-Exception: {ex}"}
 
 
 
@@ -207,26 +466,57 @@ async def producer():
         if args.verbosity > 1: print(f'{OV}entered producer(){OM}')
         message = f'{{"Type":"System","Data":"I\'m watching"}}'
         await asyncio.sleep(60)
-        await websocket.send(message)
+        await reply(message)
         if args.verbosity > 0: print(f'{OV}sent message {OR}{message}{OM}')
 
+@app.before_serving
+async def start_renderer():
+    global renderer_task, lag_task, hub_task
+    lag_task = asyncio.ensure_future(metrics.watch_loop_lag(loop_lag, loop_lag_last))
+    if hub_client is not None: # a worker; the owner renders, we just pass its broadcasts on
+        await hub_client.connect()
+        hub_task = asyncio.ensure_future(hub_client.run())
+        return
+    renderer_task = asyncio.ensure_future(renderer.run())
+
+
+@app.after_serving
+async def stop_renderer():
+    await animations.stop()
+    cancel_fade()
+    if renderer_task is not None:
+        renderer_task.cancel()
+    if lag_task is not None:
+        lag_task.cancel()
+    if hub_task is not None:
+        hub_task.cancel()
+        hub_client.close()
+    renderer.close()
+    if args.verbosity > 0 and device_stats(pixels): # --chains or --virtual
+        print(f'{OV}output timing {OR}{device_stats(pixels)}{OM}')
+
 @app.route('/api/saves', methods=['GET'])
 async def list_saved_states():
-    saves = []
-    for path in sorted(SAVE_DIR.glob('*.json')):
-        try:
-            with path.open('r', encoding='utf-8') as fp:
-                payload = json.load(fp)
-        except (OSError, json.JSONDecodeError):
-            continue
-        saves.append({
-            "name": payload.get("name", path.stem),
-            "slug": payload.get("slug", path.stem),
-            "saved_at": payload.get("saved_at"),
-            "width": payload.get("width", ROW_LENGTH),
-            "height": payload.get("height", COL_LENGTH),
-        })
-    return {"saves": saves}
+    # e.g. /api/saves?sort=saved_at&order=desc&offset=0&limit=20
+    sort = request.args.get('sort', 'slug')
+    descending = request.args.get('order', 'asc').lower() == 'desc'
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = None if limit is None else max(0, int(limit))
+    except ValueError:
+        return {"error": "offset and limit must be whole numbers."}, 400
+    def refresh_and_list():
+        save_index.refresh() # stats the files, only re-reads ones that changed
+        return save_index.listing(sort=sort, descending=descending, offset=offset, limit=limit)
+    try:
+        with save_seconds.time("list"):
+            total, listed = await run_io(refresh_and_list)
+    except ValueError as exc:
+        return {"error": str(exc)}, 400
+    except OSError as exc:
+        return {"error": f"Unable to list saves: {exc}"}, 500
+    return {"saves": listed, "total": total, "offset": offset, "limit": limit}
 
 
 @app.route('/api/saves', methods=['POST'])
@@ -248,12 +538,11 @@ async def save_current_board():
         "saved_at": datetime.now(timezone.utc).isoformat(),
         "width": ROW_LENGTH,
         "height": COL_LENGTH,
-        "pixels": snapshot_pixel_state(),
     }
-    save_path = SAVE_DIR / f"{slug}.json"
+    board = snapshot_pixel_state() # taken now, written whenever the I/O thread gets to it
     try:
-        with save_path.open('w', encoding='utf-8') as fp:
-            json.dump(record, fp)
+        with save_seconds.time("write"):
+            await save_writer.submit(slug, lambda: saves.write_save(SAVE_DIR, record, board, compress=not args.raw_saves, index=save_index))
     except OSError as exc:
         return {"error": f"Unable to write save '{display_name}': {exc}"}, 500
     return {"save": {k: record[k] for k in ("name", "slug", "saved_at", "width", "height")}}
@@ -265,15 +554,55 @@ async def load_saved_board(save_slug):
         slug = sanitize_save_name(save_slug)
     except ValueError:
         return {"error": "Save not found."}, 404
-    save_path = SAVE_DIR / f"{slug}.json"
-    if not save_path.exists():
+    save_path = saves.find_save(SAVE_DIR, slug)
+    if save_path is None:
+        return {"error": "Save not found."}, 404
+    # clients that ask for application/octet-stream get the packed save format, everyone else JSON
+    binary = request.accept_mimetypes.best_match(["application/json", saves.SAVE_MIMETYPE]) == saves.SAVE_MIMETYPE
+    try:
+        with save_seconds.time("read"):
+            if binary and save_path.suffix == saves.BINARY_SUFFIX:
+                return await run_io(save_path.read_bytes), 200, {"Content-Type": saves.SAVE_MIMETYPE} # already in wire form
+            meta, rgb = await run_io(saves.read_save, save_path)
+    except FileNotFoundError:
+        return {"error": "Save not found."}, 404
+    except (OSError, ValueError) as exc:
+        return {"error": f"Unable to read save '{slug}': {exc}"}, 500
+    if binary:
+        return await run_io(saves.encode_save, meta, rgb, compress=not args.raw_saves), 200, {"Content-Type": saves.SAVE_MIMETYPE}
+    return await run_io(saves.legacy_record, meta, rgb)
+
+
+@app.route('/api/saves/<string:save_slug>/apply', methods=['POST'])
+async def apply_saved_board(save_slug):
+    # put a save straight onto the wall; optional body {"fade": seconds} crossfades to it
+    try:
+        slug = sanitize_save_name(save_slug)
+    except ValueError:
+        return {"error": "Save not found."}, 404
+    try:
+        payload = await request.get_json(silent=True) or {}
+        fade = max(0.0, min(float(payload.get('fade', 0)), 30.0))
+    except (TypeError, ValueError, AttributeError):
+        return {"error": "fade must be a number of seconds."}, 400
+    save_path = saves.find_save(SAVE_DIR, slug)
+    if save_path is None:
         return {"error": "Save not found."}, 404
     try:
-        with save_path.open('r', encoding='utf-8') as fp:
-            payload = json.load(fp)
-    except (OSError, json.JSONDecodeError) as exc:
+        with save_seconds.time("read"):
+            meta, rgb = await run_io(saves.read_save, save_path)
+    except FileNotFoundError:
+        return {"error": "Save not found."}, 404
+    except (OSError, ValueError) as exc:
         return {"error": f"Unable to read save '{slug}': {exc}"}, 500
-    return payload
+    await apply_board(FrameBuffer.from_bytes(meta["width"], meta["height"], rgb), fade=fade)
+    return {"save": {k: meta.get(k) for k in ("name", "slug", "saved_at", "width", "height")}, "fade": fade}
+
+
+@app.route('/metrics')
+async def metrics_page():
+    # Prometheus scrape target
+    return registry.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 
 @app.websocket('/ws')
@@ -281,6 +610,7 @@ async def load_saved_board(save_slug):
 @collect_websocket
 async def ws():
     if args.verbosity > 1: print(f'{OV}entered ws(){OM}')
+    writer_task = asyncio.ensure_future(connected[websocket._get_current_object()].run())
     await broadcast('{"Type":"System","Data":"Someone connected"}')
     # await broadcast(b'{"Type":"System","Data":"This is a byte string yo!"}')
     consumer_task = asyncio.ensure_future( # copy websocket to consumer()
@@ -290,18 +620,21 @@ async def ws():
         copy_current_websocket_context(producer)(),
     )
     try:
-        result = await asyncio.gather(consumer_task, producer_task)
+        result = await asyncio.gather(consumer_task, producer_task, writer_task)
         if args.verbosity > 1: print(f'{OV}result is {OR}{result}{OM}')
+    except SlowClientError as ex:
+        print(f'{OE}Dropping websocket client: {OR}{ex}{OM}')
     finally:
         consumer_task.cancel()
         producer_task.cancel()
+        writer_task.cancel()
 
 @app.route('/')
 # defines behavior for clients requesting /
 async def index():
     if args.verbosity > 0: print(f'{OV}/ requested via {OR}{request.method}{OV}, args.verbosity={OR}{args.verbosity}{OM}')
-    width = 10 # manually setting size of grid
-    height = 20
+    width = ROW_LENGTH # size of grid, from --layout
+    height = COL_LENGTH
     # build a list of x, y values for render to iterate through, e.g. 0,0 through 9,19
     xs, ys = [], []
     for i in range(width):
@@ -310,7 +643,62 @@ async def index():
             ys += [(height - i - 1),]
     return await render_template('index.html', xs=xs, ys=ys, height=height)
 
+async def apply_published_board(width, height, fade, rgb):
+    # the owner's hub got a board from a worker, e.g. a save someone applied
+    await apply_board(FrameBuffer.from_bytes(width, height, rgb), fade=fade)
+
+
+async def serve_workers():
+    # the owner: keep the LEDs, start --workers web workers on one shared listening socket, relay between them
+    global hub
+    listener = socket.create_server(("0.0.0.0", port), backlog=128)
+    listener.set_inheritable(True)
+    hub_dir = tempfile.TemporaryDirectory(prefix="wallpretty-")
+    hub = Hub(str(Path(hub_dir.name) / "hub.sock"), handle_message, apply_published_board)
+    await hub.start()
+    await start_renderer()
+    worker_args = [sys.executable, str(Path(__file__).resolve()), *sys.argv[1:], "--pixels", str(PIXEL_COUNT),
+                   "--worker-of", hub.path, "--board", shared_board.name, "--listen-fd", str(listener.fileno())]
+    workers = [subprocess.Popen(worker_args, pass_fds=[listener.fileno()]) for _ in range(args.workers)]
+    print(f"{OR}serving on port {port} with {args.workers} workers, pids {' '.join(str(w.pid) for w in workers)}{OM}")
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel) # shut down as tidily as for Ctrl-C
+    try:
+        await asyncio.gather(*(loop.run_in_executor(None, worker.wait) for worker in workers))
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        await stop_renderer()
+        await hub.close()
+        listener.close()
+        hub_dir.cleanup()
+        shared_board.close()
+
+
+async def serve_worker():
+    # one of the owner's web workers, serving the socket the owner opened until the owner goes away
+    from hypercorn.asyncio import serve # comes with quart
+    from hypercorn.config import Config
+    config = Config()
+    config.bind = [f"fd://{args.listen_fd}"]
+    await serve(app, config, shutdown_trigger=hub_client.closed.wait)
+
+
 if __name__ == '__main__':
-    pixels.clear()
-    pixels.show()
-    app.run(host="0.0.0.0", port=port)
+    if args.worker_of:
+        try:
+            asyncio.run(serve_worker())
+        except KeyboardInterrupt: # the owner got it too and is shutting us down
+            pass
+    elif args.workers > 1:
+        pixels.clear()
+        pixels.show()
+        try:
+            asyncio.run(serve_workers())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        pixels.clear()
+        pixels.show()
+        app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Compact binary websocket messages for pixel traffic.
+# A client opts in by sending {"Type":"Protocol","Data":"binary"}; chat and system
+# messages stay JSON either way.  All integers are little-endian.
+#
+#   OP_PIXELS: 0x01, then N records of x:u16 y:u16 r:u8 g:u8 b:u8
+#   OP_FRAME:  0x02, width:u16 height:u16, then width*height RGB triples,
+#              x-major like FrameBuffer.tobytes() (all of column 0, then column 1, ...)
+#   OP_DELTA:  0x03, seq:u32 width:u16 height:u16, then a delta.py payload against the
+#              x-major frame of seq - 1; a keyframe payload stands alone.  Viewers that
+#              miss a sequence number wait for the next keyframe.
+
+import struct
+
+OP_PIXELS = 0x01
+OP_FRAME = 0x02
+OP_DELTA = 0x03
+
+PIXEL_RECORD = struct.Struct('<HHBBB')
+FRAME_HEADER = struct.Struct('<BHH')
+DELTA_HEADER = struct.Struct('<BIHH')
+
+
+def encode_pixels(records):
+    # records is an iterable of (x, y, r, g, b)
+    out = bytearray([OP_PIXELS])
+    for record in records:
+        out += PIXEL_RECORD.pack(*record)
+    return bytes(out)
+
+
+def decode_pixels(message):
+    body = memoryview(message)[1:]
+    if len(body) % PIXEL_RECORD.size:
+        raise ValueError(f"Pixel payload of {len(body)} bytes isn't a whole number of records.")
+    return list(PIXEL_RECORD.iter_unpack(body))
+
+
+def encode_frame(width, height, rgb):
+    # rgb is x-major RGB bytes, e.g. FrameBuffer.tobytes()
+    if len(rgb) != width * height * 3:
+        raise ValueError(f"Frame is {len(rgb)} bytes, expected {width * height * 3}.")
+    return FRAME_HEADER.pack(OP_FRAME, width, height) + bytes(rgb)
+
+
+def decode_frame(message):
+    _, width, height = FRAME_HEADER.unpack_from(message)
+    body = memoryview(message)[FRAME_HEADER.size:]
+    if len(body) != width * height * 3:
+        raise ValueError(f"Frame payload is {len(body)} bytes, expected {width * height * 3}.")
+    return width, height, body
+
+
+def encode_delta(seq, width, height, payload):
+    return DELTA_HEADER.pack(OP_DELTA, seq & 0xFFFFFFFF, width, height) + bytes(payload)
+
+
+def decode_delta(message):
+    _, seq, width, height = DELTA_HEADER.unpack_from(message)
+    return seq, width, height, memoryview(message)[DELTA_HEADER.size:]
+
+
+def opcode(message):
+    if not message:
+        raise ValueError("Empty binary message.")
+    return message[0]
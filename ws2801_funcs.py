@@ -3,12 +3,25 @@
 # https://github.com/adafruit/Adafruit_Python_WS2801
 
 import time
-import RPi.GPIO as GPIO
 import argparse
 
 # Import the WS2801 module.
-import Adafruit_WS2801
-import Adafruit_GPIO.SPI as SPI
+try: # without them (off the Pi) output.open_device() simulates the strip, as with --virtual
+  import RPi.GPIO as GPIO
+  import Adafruit_WS2801
+  import Adafruit_GPIO.SPI as SPI
+except ImportError:
+  GPIO = Adafruit_WS2801 = SPI = None
+
+import effects
+from effects import WHEEL
+from framebuffer import read_strip, show_frame
+from framecache import FrameCache
+from player import Player
+from profiling import open_profile
+from layout import Layout
+from output import open_device, device_stats, parse_chains
+from virtual import RGB_to_color
 
 # for coloring output
 OV = '\x1b[0;33m' # verbose
@@ -21,8 +34,16 @@ parser.add_argument("-b", "--back2front", help="whether to do the back-to-front
 parser.add_argument("-c", "--count", type=int, default=1, help="number of cycles through the program (default=1)")
 parser.add_argument("-f", "--flashes", type=int, default=0, help="number of flashes during cycles (default=0)")
 parser.add_argument("-p", "--pixels", type=int, default=200, help="number of pixels in LED set (default=200)")
+parser.add_argument("--chains", default=None, help="split the pixels across SPI chains, one per SPI port, e.g. 0.0:200,1.0:200 (default=one chain on 0.0)")
+parser.add_argument("--virtual", action="store_true", help="simulate the LEDs instead of using SPI hardware")
+parser.add_argument("--spi-hz", type=int, default=None, help="SPI clock in Hz, real or simulated (default=1000000)")
+parser.add_argument("--record", default=None, help="with --virtual, record every shown frame to this .wpa file")
+parser.add_argument("--cache-mb", type=float, default=32, help="memory for pre-rendered effect frames in MB (default=32)")
+parser.add_argument("--cache-dir", default=None, help="spill evicted effect frames to this directory (default=off)")
+parser.add_argument("--profile", default=None, help="time every frame's compute/write/show/wait; write a Chrome trace to this .json file and print the slowest frames at exit")
+parser.add_argument("--layout", default=None, help="LED wiring: serpentine, progressive[:start[:degrees]] or a .json map (default=serpentine from the lower right)")
 parser.add_argument("-v", "--verbosity", action="count", default=0, help="be more verbose")
-args = parser.parse_args()
+args, _ = parser.parse_known_args() # tolerate flags meant for whoever imported us
 
 # Configure the count of pixels:
 PIXEL_COUNT = args.pixels
@@ -30,32 +51,30 @@ PIXEL_COUNT = args.pixels
 if args.verbosity > 0:
   print("Running program for {} pixels".format(args.pixels))
 
-# Alternatively specify a hardware SPI connection on /dev/spidev0.0:
-SPI_PORT   = 0
-SPI_DEVICE = 0
-pixels = Adafruit_WS2801.WS2801Pixels(PIXEL_COUNT, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE), gpio=GPIO)
+# deterministic effects are rendered once per pixel count and replayed from memory
+frame_cache = FrameCache(budget_bytes=int(args.cache_mb * 1024 * 1024), spill_dir=args.cache_dir)
 
-
-# Define an Y,X tgrid for pixels with 0,0 in the lower left
-# Assumes back and forth layout of LEDs, starting in lower-right
+# one SPI chain on /dev/spidev0.0, or several driven in parallel with --chains; see output.py
+if __name__ == "__main__":
+  if Adafruit_WS2801 is None and not args.virtual:
+    print(OE+"WS2801 libraries not found; simulating the LEDs"+OM)
+  pixels = open_device(args, Adafruit_WS2801, SPI, GPIO)
+  PIXEL_COUNT = pixels.count()
+else: # imported for its effects; whoever imported us owns the LEDs, and the profile, and passes its device to every effect
+  pixels = None
+  args.profile = None
+  if args.chains:
+    PIXEL_COUNT = sum(count for port, device, count in parse_chains(args.chains))
+
+# per-frame timing with --profile, see profiling.py; an importer can set ws2801_funcs.profiler instead
+profiler = open_profile(args.profile) if args.profile else None
+
+
+# how the LEDs snake across the grid, 0,0 in the lower left; see layout.py
+# by default rows of ROW_LENGTH go back and forth, starting in lower-right
 ROW_LENGTH = 10
-tgrid = []
-for i in range(int(PIXEL_COUNT / ROW_LENGTH)):
-    row = []
-    for j in range(ROW_LENGTH):
-        if (i % 2 == 1): # account for wire snaking back and forth
-            row.insert(j,j + (i*ROW_LENGTH))
-        else:
-            row.insert((j),(i * ROW_LENGTH + ROW_LENGTH) - j -1)
-    tgrid.insert(i,row)
-
-# transpose to pgrid so we can use X,Y instead of Y,X to address pixels
-pgrid=[]
-for i in range(len(tgrid[0])):
-    row=[]
-    for j in range(len(tgrid)):
-        row.insert(j,tgrid[j][i])
-    pgrid.insert(i,row)
+layout = Layout.from_spec(args.layout, PIXEL_COUNT, ROW_LENGTH)
+ROW_LENGTH = layout.width # a .json map brings its own size
 
 def initial(pixels=pixels, letter='j'):
     pixels.clear()
@@ -92,132 +111,78 @@ def initial(pixels=pixels, letter='j'):
     g = 255
     b = 255
     capletter = capletter
-    for p in capletter: # draw pixel by pixel
-        if args.verbosity > 1: print(OV+"p is {OR}{p}{OM}".format(p=p,OR=OR,OM=OM))
-        if args.verbosity > 1: print(OV+"pgrid[p] is {OR}{g}{OM}".format(g=pgrid[p[0]][p[1]],OR=OR,OM=OM))
-        pixels.set_pixel(pgrid[p[0]][p[1]],Adafruit_WS2801.RGB_to_color( r, g, b ))
-        pixels.show()
-        time.sleep(.1)
-    for c in range(9):
-        if args.verbosity > 1: print(OV+"c is {OR}{c}{OM}".format(c=c,OR=OR,OM=OM))
-        for p in capletter:
-            if (c % 3 == 0):
-                pixels.set_pixel(pgrid[p[0]][p[1]],Adafruit_WS2801.RGB_to_color( 255, 0, 0 ))
-            elif (c % 3 == 1):
-                pixels.set_pixel(pgrid[p[0]][p[1]],Adafruit_WS2801.RGB_to_color( 0, 255, 0 ))
-            else:
-                pixels.set_pixel(pgrid[p[0]][p[1]],Adafruit_WS2801.RGB_to_color( 0, 0, 255 ))
-        pixels.show()
-        time.sleep(.1)
+    leds = layout.positions(capletter) # strip position of every point, looked up once
+    def draw(): # each step leaves the next frame in the strip's buffer
+        for p, n in zip(capletter, leds): # draw pixel by pixel
+            if args.verbosity > 1: print(OV+"p is {OR}{p}{OM}".format(p=p,OR=OR,OM=OM))
+            if args.verbosity > 1: print(OV+"layout position is {OR}{n}{OM}".format(n=n,OR=OR,OM=OM))
+            pixels.set_pixel(n,RGB_to_color( r, g, b ))
+            yield
+        for c in range(9):
+            if args.verbosity > 1: print(OV+"c is {OR}{c}{OM}".format(c=c,OR=OR,OM=OM))
+            for n in leds:
+                if (c % 3 == 0):
+                    pixels.set_pixel(n,RGB_to_color( 255, 0, 0 ))
+                elif (c % 3 == 1):
+                    pixels.set_pixel(n,RGB_to_color( 0, 255, 0 ))
+                else:
+                    pixels.set_pixel(n,RGB_to_color( 0, 0, 255 ))
+            yield
+    # ten frames a second, every one of them shown
+    Player(10, drop_late=False, profiler=profiler).play(draw(), lambda frame: pixels.show(), label="initial")
+
 
+# Push frames to the strip on a fixed schedule; wait is the time per frame (0 = as fast as possible)
+def play(pixels, frames, wait, label="play"):
+    stats = Player(1.0 / wait if wait > 0 else None, profiler=profiler).play(frames, lambda frame: show_frame(pixels, frame, profiler), label=label)
+    if args.verbosity > 1: print(OV+"played {s}{OM}".format(s=stats,OM=OM))
+    return stats
 
 # Define the wheel function to interpolate between different hues.
 def wheel(pos):
-    if pos < 85:
-        return Adafruit_WS2801.RGB_to_color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Adafruit_WS2801.RGB_to_color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Adafruit_WS2801.RGB_to_color(0, pos * 3, 255 - pos * 3)
+    r, g, b = WHEEL[pos % 256].tolist()
+    return RGB_to_color(r, g, b)
 
 # Define rainbow cycle function to do a cycle of all hues.
 def rainbow_cycle_successive(pixels=pixels, wait=0.001):
     if args.verbosity > 1: print("rainbow_cycle_successive(pixels={p},wait={w})".format(p=pixels,w=wait))
-    for i in range(pixels.count()):
-        # tricky math! we use each pixel as a fraction of the full 96-color wheel
-        # (thats the i / strip.numPixels() part)
-        # Then add in j which makes the colors go around per pixel
-        # the % 96 is to make the wheel cycle around
-        pixels.set_pixel(i, wheel(((i * 256 // pixels.count())) % 256) )
-        pixels.show()
-        if wait > 0:
-            time.sleep(wait)
+    # each pixel gets its own fraction of the 256-color wheel, filled in one at a time
+    play(pixels, effects.rainbow_cycle_successive_frames(pixels.count(), read_strip(pixels)), wait, "rainbow_cycle_successive")
 
 def rainbow_cycle(pixels=pixels, wait=0.005):
     if args.verbosity > 1: print("rainbow_cycle(pixels={p},wait={w})".format(p=pixels,w=wait))
-    for j in range(256): # one cycle of all 256 colors in the wheel
-        for i in range(pixels.count()):
-            pixels.set_pixel(i, wheel(((i * 256 // pixels.count()) + j) % 256) )
-        pixels.show()
-        if wait > 0:
-            time.sleep(wait)
+    frames = frame_cache.get("rainbow_cycle", {}, pixels.count(), lambda: effects.rainbow_cycle_frames(pixels.count()))
+    play(pixels, frames, wait, "rainbow_cycle") # one cycle of all 256 colors in the wheel
 
 def rainbow_colors(pixels=pixels, wait=0.05):
     if args.verbosity > 1: print("rainbow_colors(pixels={p},wait={w})".format(p=pixels,w=wait))
-    for j in range(256): # one cycle of all 256 colors in the wheel
-        for i in range(pixels.count()):
-            pixels.set_pixel(i, wheel(((256 // pixels.count() + j)) % 256) )
-        pixels.show()
-        if wait > 0:
-            time.sleep(wait)
+    frames = frame_cache.get("rainbow_colors", {}, pixels.count(), lambda: effects.rainbow_colors_frames(pixels.count()))
+    play(pixels, frames, wait, "rainbow_colors") # one cycle of all 256 colors in the wheel
 
 def brightness_decrease(pixels=pixels, wait=0.01, step=1):
     if args.verbosity > 1: print("brightness_decrease(pixels={p},wait={w},step={s})".format(p=pixels,w=wait,s=step))
-    for j in range(int(256 // step)):
-        for i in range(pixels.count()):
-            r, g, b = pixels.get_pixel_rgb(i)
-            r = int(max(0, r - step))
-            g = int(max(0, g - step))
-            b = int(max(0, b - step))
-            pixels.set_pixel(i, Adafruit_WS2801.RGB_to_color( r, g, b ))
-        pixels.show()
-        if wait > 0:
-            time.sleep(wait)
+    play(pixels, effects.brightness_decrease_frames(read_strip(pixels), step), wait, "brightness_decrease")
 
 def blink_color(pixels=pixels, blink_times=5, wait=0.005, color=(255,0,0)):
     if args.verbosity > 1: print("blink_color(pixels={p},blink_times={b},wait={w},color={c})".format(p=pixels,b=blink_times,w=wait,c=[color[0],color[1],color[2]]))
+    frames = frame_cache.get("blink_color", {"color": tuple(color)}, pixels.count(), lambda: effects.blink_frames(pixels.count(), color))
     for i in range(blink_times):
         # blink two times, then wait
-        pixels.clear()
-        for j in range(2):
-            for k in range(pixels.count()):
-                pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-            pixels.show()
-            time.sleep(0.08)
-            pixels.clear()
-            pixels.show()
-            time.sleep(0.08)
+        play(pixels, frames, 0.08, "blink_color")
         time.sleep(wait)
 
 def checker_board(pixels=pixels, blink_times=5, wait=0.005, color=(255,0,0)):
-    if args.verbosity > 1: print("blink_color(pixels={p},blink_times={b},wait={w},color={c})".format(p=pixels,b=blink_times,w=wait,c=[color[0],color[1],color[2]]))
+    if args.verbosity > 1: print("checker_board(pixels={p},blink_times={b},wait={w},color={c})".format(p=pixels,b=blink_times,w=wait,c=[color[0],color[1],color[2]]))
+    frames = frame_cache.get("checker_board", {"color": tuple(color)}, pixels.count(), lambda: effects.checker_board_frames(pixels.count(), color))
     for i in range(blink_times):
         # blink two times, then wait
+        play(pixels, frames, 0.08, "checker_board")
         pixels.clear()
-        for j in range(2):
-            for k in range(pixels.count()):
-                if k % 2 == 1:
-                    pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-                else:
-                    pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( 0, 0, 0 ))
-            pixels.show()
-            time.sleep(0.08)
-            pixels.clear()
-            for k in range(pixels.count()):
-                if k % 2 == 0:
-                    pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-                else:
-                    pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( 0, 0, 0 ))
-            pixels.show()
-            time.sleep(0.08)
-            pixels.clear()
         time.sleep(wait)
 
 def appear_from_back(pixels=pixels, color=(255, 0, 0)):
     if args.verbosity > 1: print("appear_from_back(pixels={p},color={c})".format(p=pixels,c=[color[0],color[1],color[2]]))
-    pos = 0
-    for i in range(pixels.count()):
-        for j in reversed(range(i, pixels.count())):
-            pixels.clear()
-            # first set all pixels at the begin
-            for k in range(i):
-                pixels.set_pixel(k, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-            # set then the pixel at position j
-            pixels.set_pixel(j, Adafruit_WS2801.RGB_to_color( color[0], color[1], color[2] ))
-            pixels.show()
-            # time.sleep(0.00002)
+    play(pixels, effects.appear_from_back_frames(pixels.count(), color), 0, "appear_from_back")
 
 if __name__ == "__main__":
     # Clear all the pixels to turn them off.
@@ -239,3 +204,5 @@ if __name__ == "__main__":
             blink_color(pixels, blink_times = 1, color=(0, 0, 255))
         rainbow_colors(pixels)
         brightness_decrease(pixels)
+    if args.verbosity > 0 and device_stats(pixels): # --chains or --virtual
+        print(OV+"output timing {OR}{t}{OM}".format(t=device_stats(pixels),OR=OR,OM=OM))